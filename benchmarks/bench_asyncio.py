@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_asyncio.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: event loop lag under heavy logging, blocking vs `JsonAsyncHandler`.
+
+Usage:
+    python benchmarks/bench_asyncio.py [--records N] [--burst N]
+        [--slow-write-ms MS] [--json RESULT.json]
+
+A ticker coroutine sleeps ``1ms`` repeatedly and measures how late it wakes
+up (the loop lag), while a producer coroutine logs ``--burst`` records at a
+time until ``--records`` records are logged. ``--slow-write-ms`` makes
+every write to the file that slow, like a busy disk or a network file
+system.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from jsonformatter import JsonAsyncHandler, JsonFormatter
+
+TICK = 0.001
+
+
+class SlowFileHandler(logging.FileHandler):
+
+    slow_write = 0
+
+    def emit(self, record):
+        if self.slow_write:
+            time.sleep(self.slow_write)
+        logging.FileHandler.emit(self, record)
+
+
+class SlowAsyncHandler(JsonAsyncHandler):
+
+    slow_write = 0
+
+    def writeFile(self, data):
+        if self.slow_write:
+            time.sleep(self.slow_write)
+        JsonAsyncHandler.writeFile(self, data)
+
+
+def percentile(sorted_values, p):
+    i = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))
+    return sorted_values[i]
+
+
+async def ticker(lags, stop):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def producer(logger, records, burst):
+    for i in range(0, records, burst):
+        for j in range(i, min(i + burst, records)):
+            logger.info('bench asyncio %d', j, extra={'index': j})
+        # let the other tasks run
+        await asyncio.sleep(0)
+
+
+async def run_case(handler, records, burst):
+    logger = logging.getLogger('bench.asyncio')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, stop))
+    start = time.time()
+    try:
+        await producer(logger, records, burst)
+        if isinstance(handler, JsonAsyncHandler):
+            await handler.drain()
+        elapsed = time.time() - start
+    finally:
+        stop.set()
+        await tick
+        logger.removeHandler(handler)
+        if isinstance(handler, JsonAsyncHandler):
+            await handler.aclose()
+        else:
+            handler.close()
+    lags.sort()
+    return OrderedDict([
+        ('records_per_sec', records / elapsed),
+        ('lag_p50_ms', percentile(lags, 50) * 1000),
+        ('lag_p99_ms', percentile(lags, 99) * 1000),
+        ('lag_max_ms', lags[-1] * 1000),
+        ('ticks', len(lags))
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--burst', type=int, default=100,
+                        help='records logged between two yields to the loop')
+    parser.add_argument('--slow-write-ms', type=float, default=0)
+    parser.add_argument('--json', default=None, help='write the results to it')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='jsonformatter_bench_')
+    results = []
+    try:
+        def blocking():
+            handler = SlowFileHandler(os.path.join(directory, 'blocking.log'))
+            handler.slow_write = args.slow_write_ms / 1000.0
+            handler.setFormatter(JsonFormatter(mix_extra=True))
+            return handler
+
+        def async_handler():
+            handler = SlowAsyncHandler(os.path.join(directory, 'async.log'))
+            handler.slow_write = args.slow_write_ms / 1000.0
+            handler.setFormatter(JsonFormatter(mix_extra=True))
+            return handler
+
+        for name, make in (('logging.FileHandler', blocking), ('JsonAsyncHandler', async_handler)):
+            loop = asyncio.new_event_loop()
+            try:
+                result = loop.run_until_complete(run_case(make(), args.records, args.burst))
+            finally:
+                loop.close()
+            result['name'] = name
+            results.append(result)
+            sys.stdout.write('%-24s %9.0f records/sec, loop lag p50 %7.3fms p99 %7.3fms max %7.3fms\n' % (
+                name, result['records_per_sec'], result['lag_p50_ms'],
+                result['lag_p99_ms'], result['lag_max_ms']))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
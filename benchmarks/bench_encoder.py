@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_encoder.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: compare `json.dumps` per record with the cached `JSONEncoder`.
+"""
+import json
+import logging
+import sys
+import timeit
+
+from jsonformatter import JsonFormatter
+
+NUMBER = 20000
+
+
+def make_record():
+    return logging.LogRecord(
+        'bench', logging.INFO, __file__, 1, 'bench %s', ('encoder',), None
+    )
+
+
+def bench(formatter, number=NUMBER):
+    record = make_record()
+    seconds = min(timeit.repeat(
+        lambda: formatter.format(record), number=number, repeat=3))
+    return number / seconds
+
+
+class _DumpsEncoder(object):
+
+    def __init__(self, formatter):
+        self.formatter = formatter
+
+    def encode(self, obj):
+        formatter = self.formatter
+        return json.dumps(
+            obj,
+            skipkeys=formatter.skipkeys,
+            ensure_ascii=formatter.ensure_ascii,
+            check_circular=formatter.check_circular,
+            allow_nan=formatter.allow_nan,
+            cls=formatter.cls,
+            indent=formatter.indent,
+            separators=formatter.separators,
+            default=formatter.default,
+            sort_keys=formatter.sort_keys,
+            **formatter.kw
+        )
+
+
+class DumpsJsonFormatter(JsonFormatter):
+    """The `json.dumps` per record behaviour before the encoder was cached."""
+
+    def getEncoder(self):
+        return _DumpsEncoder(self)
+
+
+def main():
+    cases = [
+        ('defaults', {}),
+        ('ensure_ascii=False, separators', {
+            'ensure_ascii': False, 'separators': (',', ':')}),
+    ]
+    for name, kwargs in cases:
+        dumps = bench(DumpsJsonFormatter(**kwargs))
+        cached = bench(JsonFormatter(**kwargs))
+        sys.stdout.write('%-32s json.dumps: %9.0f records/sec, cached encoder: %9.0f records/sec (%+.1f%%)\n' % (
+            name, dumps, cached, (cached / dumps - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_format.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: records/sec and memory per record of `JsonFormatter.format`.
+
+Usage:
+    python benchmarks/bench_format.py [--number N] [--filter NAME]
+        [--json RESULT.json] [--compare BASE.json]
+
+``--json`` writes the results to be compared across commits, ``--compare``
+prints the change of records/sec from a result written before.
+"""
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from collections import OrderedDict
+
+from jsonformatter import JsonFormatter, JsonLogger
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+NUMBER = 20000
+REPEAT = 3
+
+PERCENT_FORMAT = OrderedDict([
+    ("name", "name"),
+    ("levelname", "levelname"),
+    ("asctime", "asctime"),
+    ("location", "%(pathname)s:%(lineno)d"),
+    ("message", "message")
+])
+STR_FORMAT = OrderedDict([
+    ("name", "name"),
+    ("levelname", "levelname"),
+    ("asctime", "asctime"),
+    ("location", "{pathname}:{lineno}"),
+    ("message", "message")
+])
+TEMPLATE_FORMAT = OrderedDict([
+    ("name", "name"),
+    ("levelname", "levelname"),
+    ("asctime", "asctime"),
+    ("location", "${pathname}:${lineno}"),
+    ("message", "message")
+])
+CUSTOM_FORMAT = OrderedDict([
+    ("levelname", "levelname"),
+    ("message", "message"),
+    ("user", "user"),
+    ("request_id", "request_id")
+])
+RECORD_CUSTOM_ATTRS = {
+    'user': lambda: 'admin',
+    'request_id': lambda: '5f0c6d1e'
+}
+EXTRA = {
+    'status': 200,
+    'elapsed': 0.0123,
+    'path': '/api/v1/users',
+    'tags': ['a', 'b']
+}
+
+
+def make_record(exc_info=None, extra=None):
+    record = logging.LogRecord(
+        'bench', logging.INFO, __file__, 1, 'bench %s', ('format',), exc_info
+    )
+    record.__dict__.update(extra or {})
+    return record
+
+
+def make_logger_record(extra=None):
+    # `JsonLogger` stores the keys of `extra` in the record
+    return JsonLogger('bench').makeRecord(
+        'bench', logging.INFO, __file__, 1, 'bench %s', ('format',), None, extra=extra)
+
+
+def make_exc_record():
+    try:
+        {}['missing']
+    except KeyError:
+        return make_record(sys.exc_info())
+
+
+def cases():
+    """
+    Return ``[(name, formatter, record factory)]``.
+    """
+    return [
+        ('stdlib logging.Formatter', logging.Formatter(
+            '%(name)s %(levelname)s %(asctime)s %(pathname)s:%(lineno)d %(message)s'), make_record),
+        ('style %', JsonFormatter(PERCENT_FORMAT, style='%'), make_record),
+        ('style {', JsonFormatter(STR_FORMAT, style='{'), make_record),
+        ('style $', JsonFormatter(TEMPLATE_FORMAT, style='$'), make_record),
+        ('mix_extra head', JsonFormatter(
+            PERCENT_FORMAT, mix_extra=True, mix_extra_position='head'), lambda: make_record(extra=EXTRA)),
+        ('mix_extra tail', JsonFormatter(
+            PERCENT_FORMAT, mix_extra=True, mix_extra_position='tail'), lambda: make_record(extra=EXTRA)),
+        ('mix_extra mix', JsonFormatter(
+            PERCENT_FORMAT, mix_extra=True, mix_extra_position='mix'), lambda: make_record(extra=EXTRA)),
+        ('mix_extra tail, JsonLogger', JsonFormatter(
+            PERCENT_FORMAT, mix_extra=True, mix_extra_position='tail'), lambda: make_logger_record(extra=EXTRA)),
+        ('record_custom_attrs off', JsonFormatter(
+            CUSTOM_FORMAT), lambda: make_record(extra={'user': 'admin', 'request_id': '5f0c6d1e'})),
+        ('record_custom_attrs on', JsonFormatter(
+            CUSTOM_FORMAT, record_custom_attrs=RECORD_CUSTOM_ATTRS), make_record),
+        ('stdlib exception', logging.Formatter(), make_exc_record),
+        ('exception', JsonFormatter(), make_exc_record),
+        ('exception, no cache', JsonFormatter(exc_cache_size=0), make_exc_record),
+        ('exception, structured_exc', JsonFormatter(
+            '{"message": "message", "exc_type": "exc_type", "exc_frames": "exc_frames"}',
+            structured_exc=True), make_exc_record),
+        ('ensure_ascii=False', JsonFormatter(PERCENT_FORMAT, ensure_ascii=False), make_record),
+        ('indent=4', JsonFormatter(PERCENT_FORMAT, indent=4), make_record),
+        ('collect_stats', JsonFormatter(PERCENT_FORMAT, collect_stats=True), make_record),
+    ]
+
+
+def run(formatter, record, attrs):
+    # the formatter caches and stores attributes in the record (e.g.
+    # `message`, `exc_text` and the scanned extra), every run formats the
+    # record as it is made
+    record.__dict__ = attrs.copy()
+    return formatter.format(record)
+
+
+def measure_speed(formatter, record, attrs, number, repeat):
+    seconds = min(timeit.repeat(
+        lambda: run(formatter, record, attrs), number=number, repeat=repeat))
+    return number / seconds
+
+
+def measure_memory(formatter, record, attrs, number):
+    """
+    Return ``(peak, retained)`` bytes per record traced by ``tracemalloc``,
+    ``peak`` is the most memory allocated while one record is formatted,
+    ``retained`` is what is left after formatting ``number`` records.
+    """
+    if tracemalloc is None:
+        return None, None
+    run(formatter, record, attrs)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(number):
+            run(formatter, record, attrs)
+        retained = (tracemalloc.get_traced_memory()[0] - before) / float(number)
+        # only python3.9+ can reset the peak without tracing again
+        tracemalloc.stop()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        run(formatter, record, attrs)
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return peak, retained
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, base_path):
+    with open(base_path) as f:
+        base = dict((r['name'], r) for r in json.load(f)['results'])
+    for result in results:
+        old = base.get(result['name'])
+        if old is None:
+            continue
+        sys.stdout.write('%-32s %9.0f -> %9.0f records/sec (%+.1f%%)\n' % (
+            result['name'], old['records_per_sec'], result['records_per_sec'],
+            (result['records_per_sec'] / old['records_per_sec'] - 1) * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=NUMBER)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--filter', default=None,
+                        help='only run the cases whose name contains it')
+    parser.add_argument('--json', default=None, help='write the results to it')
+    parser.add_argument('--compare', default=None,
+                        help='compare with the results written by `--json`')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, formatter, make in cases():
+        if args.filter and args.filter not in name:
+            continue
+        record = make()
+        attrs = record.__dict__.copy()
+        speed = measure_speed(formatter, record, attrs, args.number, args.repeat)
+        peak, retained = measure_memory(formatter, record, attrs, min(args.number, 1000))
+        results.append(OrderedDict([
+            ('name', name),
+            ('records_per_sec', speed),
+            ('peak_bytes_per_record', peak),
+            ('retained_bytes_per_record', retained),
+            ('output_bytes', len(run(formatter, record, attrs).encode('utf-8')))
+        ]))
+        sys.stdout.write('%-32s %9.0f records/sec %8s peak bytes %8s retained bytes\n' % (
+            name, speed, peak, None if retained is None else '%.1f' % retained))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(OrderedDict([
+                ('commit', git_commit()),
+                ('python', platform.python_version()),
+                ('implementation', platform.python_implementation()),
+                ('platform', platform.platform()),
+                ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                ('number', args.number),
+                ('results', results)
+            ]), f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: bench_handlers.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: records/sec of file handlers writing `JsonFormatter` output.
+
+Usage:
+    python benchmarks/bench_handlers.py [--number N] [--json RESULT.json]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+
+from jsonformatter import (JsonBatchFileHandler, JsonFileHandler,
+                           JsonFormatter, JsonRotatingFileHandler)
+
+NUMBER = 50000
+
+FORMAT = OrderedDict([
+    ("name", "name"),
+    ("levelname", "levelname"),
+    ("asctime", "asctime"),
+    ("message", "message")
+])
+
+
+def cases(directory):
+    """
+    Return ``[(name, handler factory)]``.
+    """
+    def path(name):
+        return os.path.join(directory, name + '.log')
+
+    return [
+        ('logging.FileHandler', lambda: logging.FileHandler(path('file'))),
+        ('JsonFileHandler', lambda: JsonFileHandler(path('json_file'))),
+        ('JsonRotatingFileHandler', lambda: JsonRotatingFileHandler(
+            path('rotating'), max_bytes=10 * 1024 * 1024, backup_count=2)),
+        ('JsonBatchFileHandler 100 records', lambda: JsonBatchFileHandler(
+            path('batch_100'), batch_records=100, batch_bytes=1024 * 1024)),
+        ('JsonBatchFileHandler 1000 records', lambda: JsonBatchFileHandler(
+            path('batch_1000'), batch_records=1000, batch_bytes=1024 * 1024)),
+        ('JsonBatchFileHandler 16KB', lambda: JsonBatchFileHandler(
+            path('batch_16k'), batch_records=100000, batch_bytes=16 * 1024)),
+        ('JsonBatchFileHandler 256KB', lambda: JsonBatchFileHandler(
+            path('batch_256k'), batch_records=100000, batch_bytes=256 * 1024)),
+    ]
+
+
+def bench(handler, number):
+    handler.setFormatter(JsonFormatter(FORMAT))
+    record = logging.LogRecord(
+        'bench', logging.INFO, __file__, 1, 'bench %s', ('handler',), None)
+    handle = handler.handle
+    seconds = timeit.timeit(lambda: handle(record), number=number)
+    handler.close()
+    return number / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=NUMBER)
+    parser.add_argument('--json', default=None, help='write the results to it')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='jsonformatter_bench_')
+    results = []
+    try:
+        for name, make in cases(directory):
+            handler = make()
+            speed = bench(handler, args.number)
+            writes = getattr(handler, 'writes', None)
+            results.append(OrderedDict([
+                ('name', name),
+                ('records_per_sec', speed),
+                ('writes', writes)
+            ]))
+            sys.stdout.write('%-36s %9.0f records/sec %8s writes\n' % (
+                name, speed, '-' if writes is None else writes))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
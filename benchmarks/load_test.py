@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: load_test.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: latency percentiles of logging calls under thread contention.
+
+Usage:
+    python benchmarks/load_test.py [--handler file|stream|memory|queue|batch]
+        [--threads N] [--records N] [--rate N] [--handler-per-thread]
+        [--json RESULT.json]
+
+Every thread logs ``--records`` records through ``JsonFormatter``, at most
+``--rate`` records per second (``0`` is unlimited). The latency of each
+logging call, the time waiting for ``Handler.lock``, the total throughput
+and the RSS growth are reported. ``--handler-per-thread`` gives every
+thread its own handler and formatter, to compare with the contention of one
+shared handler.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from jsonformatter import (JsonBatchFileHandler, JsonFormatter, JsonQueueHandler,
+                           basicConfig)
+
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
+FORMAT = OrderedDict([
+    ("name", "name"),
+    ("levelname", "levelname"),
+    ("asctime", "asctime"),
+    ("thread", "threadName"),
+    ("message", "message")
+])
+
+
+class CountingStream(object):
+    """An in-memory stream only counts the written characters."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+    def flush(self):
+        pass
+
+
+class LockTimer(object):
+    """
+    Count the time threads wait for ``Handler.lock`` of ``handler``, it
+    replaces the lock, so both ``Handler.acquire`` and ``with self.lock``
+    (``Handler.handle`` from python3.13) are timed.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.wait = 0.0
+        self.acquired = 0
+        self._lock = handler.lock
+        handler.lock = self
+
+    def acquire(self, *args, **kwargs):
+        start = _perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        if acquired:
+            # updated under the lock
+            self.wait += _perf_counter() - start
+            self.acquired += 1
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __getattr__(self, name):
+        # e.g. `_at_fork_reinit`
+        return getattr(self._lock, name)
+
+
+def rss_bytes():
+    """
+    Return the current RSS, or the max RSS if ``/proc`` isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def make_handler(kind, directory, index=0):
+    if kind == 'file':
+        handler = logging.FileHandler(os.path.join(directory, 'load_%d.log' % index))
+    elif kind == 'stream':
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+    elif kind == 'memory':
+        handler = logging.StreamHandler(CountingStream())
+    elif kind == 'batch':
+        handler = JsonBatchFileHandler(os.path.join(directory, 'load_%d.log' % index))
+    elif kind == 'queue':
+        return JsonQueueHandler([make_handler('file', directory, index)])
+    else:
+        raise ValueError('Unknown handler: %s' % kind)
+    handler.setFormatter(JsonFormatter(FORMAT))
+    return handler
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))
+    return sorted_values[i]
+
+
+def worker(logger, records, rate, latencies, start_event):
+    interval = 1.0 / rate if rate else 0
+    append = latencies.append
+    info = logger.info
+    start_event.wait()
+    next_time = _perf_counter()
+    for i in range(records):
+        if interval:
+            delay = next_time - _perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_time += interval
+        start = _perf_counter()
+        info('load test %d', i, extra={'index': i})
+        append(_perf_counter() - start)
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='jsonformatter_load_')
+    handlers = []
+    loggers = []
+    try:
+        if args.handler_per_thread:
+            for i in range(args.threads):
+                logger = logging.getLogger('load.%d' % i)
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                handler = make_handler(args.handler, directory, i)
+                logger.addHandler(handler)
+                handlers.append(handler)
+                loggers.append(logger)
+        else:
+            if args.handler == 'file':
+                # the `basicConfig` path of most applications
+                basicConfig(
+                    filename=os.path.join(directory, 'load.log'),
+                    format=FORMAT, level=logging.INFO, force=True)
+                handler = logging.getLogger().handlers[0]
+            else:
+                handler = make_handler(args.handler, directory)
+                root = logging.getLogger()
+                for h in root.handlers[:]:
+                    root.removeHandler(h)
+                root.addHandler(handler)
+                root.setLevel(logging.INFO)
+            handlers.append(handler)
+            loggers = [logging.getLogger('load')] * args.threads
+        timers = [LockTimer(handler) for handler in handlers]
+
+        latencies = [[] for _ in range(args.threads)]
+        start_event = threading.Event()
+        threads = [
+            threading.Thread(
+                target=worker, name='load-%d' % i,
+                args=(loggers[i], args.records, args.rate, latencies[i], start_event))
+            for i in range(args.threads)
+        ]
+        for t in threads:
+            t.start()
+        rss_before = rss_bytes()
+        start = _perf_counter()
+        start_event.set()
+        for t in threads:
+            t.join()
+        for handler in handlers:
+            handler.flush()
+        elapsed = _perf_counter() - start
+        rss_after = rss_bytes()
+    finally:
+        for handler in handlers:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    merged = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+    total = len(merged)
+    return OrderedDict([
+        ('handler', args.handler),
+        ('threads', args.threads),
+        ('handler_per_thread', args.handler_per_thread),
+        ('rate_per_thread', args.rate),
+        ('records', total),
+        ('seconds', elapsed),
+        ('records_per_sec', total / elapsed),
+        ('p50_us', percentile(merged, 50) * 1e6),
+        ('p99_us', percentile(merged, 99) * 1e6),
+        ('p999_us', percentile(merged, 99.9) * 1e6),
+        ('max_us', merged[-1] * 1e6),
+        ('lock_wait_percent', sum(t.wait for t in timers) / sum(merged) * 100),
+        ('rss_growth_bytes', None if rss_before is None else rss_after - rss_before),
+        ('python', platform.python_version()),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--handler', choices=['file', 'stream', 'memory', 'queue', 'batch'], default='file')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--records', type=int, default=20000,
+                        help='records logged by every thread')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='records per second of every thread, 0 is unlimited')
+    parser.add_argument('--handler-per-thread', action='store_true')
+    parser.add_argument('--json', default=None, help='write the result to it')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    for k, v in result.items():
+        sys.stdout.write('%-20s %s\n' % (k, '%.1f' % v if isinstance(v, float) else v))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
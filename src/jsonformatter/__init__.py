@@ -8,9 +8,59 @@ Email: yourname@email.com
 Github: https://github.com/yourname
 Description: jsonformatter.py
 """
-from .jsonformatter import JsonFormatter, basicConfig
+import sys
 
-__all__ = ['JsonFormatter', 'basicConfig']
+from .jsonformatter import (CachedCustomAttr, JsonFormatter, JsonLogger,
+                            basicConfig)
+from .filters import SamplingFilter
+
+__all__ = ['JsonFormatter', 'JsonLogger', 'CachedCustomAttr', 'basicConfig',
+           'JsonFileHandler', 'JsonQueueHandler', 'JsonQueueListener',
+           'JsonRotatingFileHandler', 'JsonBatchFileHandler',
+           'JsonLogstashHandler', 'SamplingFilter']
+
+# the handlers import gzip, socket and http.client, `JsonAsyncHandler`
+# imports asyncio, they are imported when first used
+_LAZY_ATTRIBUTES = {
+    'JsonFileHandler': 'handlers',
+    'JsonQueueHandler': 'handlers',
+    'JsonQueueListener': 'handlers',
+    'JsonRotatingFileHandler': 'handlers',
+    'JsonBatchFileHandler': 'handlers',
+    'JsonLogstashHandler': 'handlers'
+}
+
+# compatible python2, python3.4 no `async def` start
+if sys.version_info >= (3, 5):
+    _LAZY_ATTRIBUTES['JsonAsyncHandler'] = 'aio'
+    __all__.append('JsonAsyncHandler')
+# compatible python2, python3.4 no `async def` end
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name in _LAZY_ATTRIBUTES:
+            module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__)
+        elif name in ('handlers', 'aio'):
+            # imported by `import jsonformatter` before
+            return importlib.import_module('.' + name, __name__)
+        else:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name))
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()).union(__all__))
+else:
+    # compatible python2, python3.6 no module `__getattr__` start
+    from .handlers import (JsonBatchFileHandler, JsonFileHandler,
+                           JsonLogstashHandler, JsonQueueHandler,
+                           JsonQueueListener, JsonRotatingFileHandler)
+    if sys.version_info >= (3, 5):
+        from .aio import JsonAsyncHandler
+    # compatible python2, python3.6 no module `__getattr__` end
 
 version_info = (0, 3, 4)
 version = '.'.join(str(v) for v in version_info)
\ No newline at end of file
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: aio.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: aio.py
+"""
+import asyncio
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from .handlers import DEFAULT_BUFFER_SIZE, _formatBytes
+from .jsonformatter import JsonFormatter
+
+
+def _running_loop():
+    """
+    Return the event loop running in current thread, ``None`` if no one.
+    """
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:
+        # compatible python3.6, no `asyncio.get_running_loop`
+        pass
+    except RuntimeError:
+        return None
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        # no event loop in other threads, e.g. executor threads
+        return None
+    return loop if loop.is_running() else None
+
+
+class JsonAsyncHandler(logging.Handler):
+    """
+    A handler for event loop applications, ``emit`` formats the record by
+    ``JsonFormatter`` (default ``JsonFormatter()``) and appends the bytes to
+    a buffer owned by the loop, no file or socket is written in the loop.
+
+    A drain task of the loop writes the buffer to ``writer`` (an
+    ``asyncio.StreamWriter``, non-blocking) or to ``filename`` (by a single
+    executor thread), ``await handler.drain()`` waits until the buffer is
+    written, ``await handler.aclose()`` drains and closes the handler.
+
+    Records emitted by other threads are passed to the loop thread safely,
+    records emitted when the loop isn't running (e.g. ``logging.shutdown``
+    at exit) are written at once, ``close()`` writes the buffered records
+    too, even if the loop is running. If the buffer is over
+    ``max_buffer_bytes``, new records are dropped and counted by
+    ``dropped``, the loop is never blocked.
+    """
+
+    terminator = b'\n'
+
+    def __init__(self, filename=None, writer=None, mode='ab', loop=None, max_buffer_bytes=16 * 1024 * 1024, buffer_size=DEFAULT_BUFFER_SIZE):
+        if (filename is None) == (writer is None):
+            raise ValueError('Only one of `filename` and `writer` must be given.')
+        logging.Handler.__init__(self)
+        self.setFormatter(JsonFormatter())
+        self.filename = filename
+        self.writer = writer
+        self.mode = mode if 'b' in mode else mode + 'b'
+        self.loop = loop
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffer_size = buffer_size
+        self.dropped = 0
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._task = None
+        self._file = None
+        self._executor = ThreadPoolExecutor(1) if filename is not None else None
+
+    def emit(self, record):
+        try:
+            data = _formatBytes(self, record) + self.terminator
+            running = _running_loop()
+            if self.loop is None:
+                self.loop = running
+            if running is not None and running is self.loop:
+                self.append(data)
+            elif self.loop is not None and self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.append, data)
+            else:
+                self.writeNow(data)
+        except Exception:
+            self.handleError(record)
+
+    def append(self, data):
+        """
+        Append ``data`` to the buffer and start the drain task, must be
+        called in the loop.
+        """
+        if self._buffer_bytes + len(data) > self.max_buffer_bytes:
+            self.dropped += 1
+            return
+        self._buffer.append(data)
+        self._buffer_bytes += len(data)
+        if self._task is None:
+            self._task = self.loop.create_task(self._drainBuffer())
+
+    async def _drainBuffer(self):
+        try:
+            while self._buffer:
+                batch = self._buffer
+                self._buffer = []
+                self._buffer_bytes = 0
+                try:
+                    await self.write(b''.join(batch))
+                except Exception:
+                    self.dropped += len(batch)
+                    traceback.print_exc()
+        finally:
+            self._task = None
+
+    async def write(self, data):
+        if self.writer is not None:
+            self.writer.write(data)
+            await self.writer.drain()
+        else:
+            await self.loop.run_in_executor(self._executor, self.writeFile, data)
+
+    def writeFile(self, data):
+        if self._file is None:
+            self._file = open(self.filename, self.mode, self.buffer_size)
+        self._file.write(data)
+        # one batch is one write to the file
+        self._file.flush()
+
+    def writeNow(self, data):
+        """
+        Write ``data`` when no loop is running, the buffered data is
+        written before it.
+        """
+        data = b''.join(self._buffer) + data
+        self._buffer = []
+        self._buffer_bytes = 0
+        if self.writer is not None:
+            # the transport writes as much as it can without blocking
+            self.writer.write(data)
+            return
+        try:
+            # after the batch the executor may be writing
+            future = self._executor.submit(self.writeFile, data)
+        except RuntimeError:
+            # the executor is shut down by `close`
+            self.writeFile(data)
+        else:
+            future.result()
+
+    async def drain(self):
+        """
+        Wait until all the buffered records are written.
+        """
+        while self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def aclose(self):
+        """
+        Drain the buffer and close the file or ``writer``.
+        """
+        await self.drain()
+        if self.writer is not None:
+            self.writer.close()
+            wait_closed = getattr(self.writer, 'wait_closed', None)
+            if wait_closed is not None:
+                try:
+                    await wait_closed()
+                except (ConnectionError, OSError):
+                    pass
+        if self._executor is not None:
+            await self.loop.run_in_executor(self._executor, self.closeFile)
+        self.close()
+
+    def closeFile(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        loop = self.loop
+        if loop is not None and loop.is_running() and _running_loop() is not loop:
+            # e.g. `logging.shutdown` while the loop runs in other thread,
+            # the drain task must write the buffer before the executor is
+            # shut down
+            future = asyncio.run_coroutine_threadsafe(self.drain(), loop)
+            while loop.is_running():
+                try:
+                    future.result(0.1)
+                    break
+                except FutureTimeoutError:
+                    pass
+        self.acquire()
+        try:
+            if self._buffer:
+                # e.g. `logging.shutdown` after the loop stopped, or
+                # `close` in the loop, the loop is blocked until written
+                self.writeNow(b'')
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self.closeFile()
+        finally:
+            self.release()
+        logging.Handler.close(self)
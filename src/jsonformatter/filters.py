@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: filters.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: filters.py
+"""
+import bisect
+import logging
+import random
+import sys
+import threading
+
+from .jsonformatter import _monotonic
+
+# compatible python2, python 3  no long/basestring type, start
+if sys.version_info >= (3, 0):
+    long = int
+    basestring = str
+# compatible python2, python 3  no long/basestring type, end
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drop records before they are formatted, add it to the handler (or the
+    logger) whose formatter is ``JsonFormatter``.
+
+    ``level_rates`` maps a level to the probability its records are kept, a
+    level applies to its records and above, up to the next level in the
+    mapping, records below all levels are kept.
+
+    If ``rate`` is not ``None``, each call site (``name``, ``pathname``,
+    ``lineno``) keeps at most ``rate`` records per second, with bursts of up
+    to ``burst`` records (default ``rate``, at least one record).
+
+    If ``target_rate`` is not ``None``, the kept probability is adapted every
+    second, so that about ``target_rate`` records per second pass the filter.
+
+    Every ``summary_interval`` seconds, a record of ``summary_level`` is
+    logged by ``summary_logger`` if any record is dropped, its ``suppressed``
+    attribute lists ``name``, ``pathname``, ``lineno`` and ``count`` of the
+    call sites. If no record comes after a record is dropped, the summary is
+    logged by a timer thread, ``close()`` logs it at once (e.g. before
+    exit).
+    """
+
+    def __init__(self, level_rates=None, rate=None, burst=None, target_rate=None, summary_interval=60.0, summary_logger='jsonformatter.sampling', summary_level=logging.WARNING, name=''):
+        logging.Filter.__init__(self, name)
+        levels = []
+        for level, probability in (level_rates or {}).items():
+            if isinstance(level, basestring):
+                level = logging.getLevelName(level)
+            if not isinstance(level, (int, long)):
+                raise ValueError('Unknown level: %r' % (level, ))
+            if not 0 <= probability <= 1:
+                raise ValueError('The probability of level `%s` must be between 0 and 1.' % level)
+            levels.append((level, probability))
+        levels.sort()
+        self._levels = [level for level, _ in levels]
+        self._probabilities = [probability for _, probability in levels]
+
+        self.rate = rate
+        if burst is None and rate is not None:
+            # a bucket less than one token never keeps a record
+            burst = max(1, rate)
+        self.burst = burst
+        self.target_rate = target_rate
+        self.summary_interval = summary_interval
+        if isinstance(summary_logger, basestring):
+            summary_logger = logging.getLogger(summary_logger)
+        self.summary_logger = summary_logger
+        self.summary_level = summary_level
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # `{site: (tokens, time)}`
+        self._buckets = {}
+        # `{site: count}`
+        self._suppressed = {}
+        now = _monotonic()
+        # records came in current second, adaptive probability
+        self._window_start = now
+        self._window_count = 0
+        self._adaptive_probability = 1.0
+        self._next_summary = now + (summary_interval or 0)
+        self._timer = None
+
+    def levelProbability(self, levelno):
+        i = bisect.bisect_right(self._levels, levelno)
+        return self._probabilities[i - 1] if i else 1.0
+
+    def adaptiveProbability(self, now):
+        with self._lock:
+            elapsed = now - self._window_start
+            if elapsed >= 1:
+                rate = self._window_count / elapsed
+                self._adaptive_probability = min(1.0, self.target_rate / rate) if rate else 1.0
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._adaptive_probability
+
+    def takeToken(self, site, now):
+        with self._lock:
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                self._buckets[site] = (tokens - 1, now)
+                return True
+            self._buckets[site] = (tokens, now)
+            return False
+
+    def sample(self, record, now):
+        """
+        Return ``True`` if ``record`` is kept.
+        """
+        probability = self.levelProbability(record.levelno) if self._levels else 1.0
+        if self.target_rate is not None:
+            probability *= self.adaptiveProbability(now)
+        if probability < 1 and random.random() >= probability:
+            return False
+        if self.rate is not None:
+            return self.takeToken((record.name, record.pathname, record.lineno), now)
+        return True
+
+    def filter(self, record):
+        if getattr(self._local, 'summarizing', False):
+            # the summary record logged by this filter
+            return True
+        if not logging.Filter.filter(self, record):
+            return False
+        now = _monotonic()
+        kept = self.sample(record, now)
+        if not kept:
+            site = (record.name, record.pathname, record.lineno)
+            with self._lock:
+                self._suppressed[site] = self._suppressed.get(site, 0) + 1
+        if self.summary_interval is not None:
+            if now >= self._next_summary:
+                self.summarize(now)
+            elif not kept:
+                self.scheduleSummary(now)
+        return kept
+
+    def scheduleSummary(self, now):
+        """
+        Start the timer logs the summary when it is due, in case no record
+        comes later.
+        """
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(
+                    max(0, self._next_summary - now), self._summaryDue)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _summaryDue(self):
+        with self._lock:
+            self._timer = None
+            next_summary = self._next_summary
+            suppressed = bool(self._suppressed)
+        now = _monotonic()
+        if now >= next_summary:
+            self.summarize(now)
+        elif suppressed:
+            # summarized by a record, the rest is due next time
+            self.scheduleSummary(now)
+
+    def close(self):
+        """
+        Cancel the timer and log the summary at once.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.summarize()
+
+    def summarize(self, now=None):
+        """
+        Log the summary of records dropped since last summary at once.
+        """
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, {}
+            self._next_summary = (now or _monotonic()) + (self.summary_interval or 0)
+        if not suppressed or not self.summary_logger.isEnabledFor(self.summary_level):
+            return
+        sites = [
+            {'name': name, 'pathname': pathname, 'lineno': lineno, 'count': count}
+            for (name, pathname, lineno), count in sorted(
+                suppressed.items(), key=lambda item: -item[1])
+        ]
+        record = self.summary_logger.makeRecord(
+            self.summary_logger.name, self.summary_level, __file__, 0,
+            'suppressed %d records at %d call sites',
+            (sum(suppressed.values()), len(sites)), None,
+            extra={'suppressed': sites})
+        self._local.summarizing = True
+        try:
+            self.summary_logger.handle(record)
+        finally:
+            self._local.summarizing = False
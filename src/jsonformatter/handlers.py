@@ -0,0 +1,768 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File: handlers.py
+Author: Me
+Email: yourname@email.com
+Github: https://github.com/yourname
+Description: handlers.py
+"""
+import copy
+import gzip
+import io
+import logging
+import os
+import random
+import shutil
+import socket
+import threading
+import traceback
+from collections import deque
+
+from .jsonformatter import JsonFormatter, _monotonic
+
+# compatible python2 start
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlsplit
+# compatible python2 end
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+def _formatBytes(handler, record):
+    """
+    Format ``record`` by ``handler``'s formatter to bytes, use
+    ``formatBytes`` if the formatter is a ``JsonFormatter``.
+    """
+    formatter = handler.formatter
+    format_bytes = getattr(formatter, 'formatBytes', None)
+    if format_bytes is not None:
+        return format_bytes(record)
+    return handler.format(record).encode(handler.encoding or 'utf-8', 'backslashreplace')
+
+
+class JsonFileHandler(logging.FileHandler):
+    """
+    A handler writes ``JsonFormatter.formatBytes`` bytes to a file opened in
+    binary mode, one record per line, through a buffer of ``buffer_size``
+    bytes, no text layer encodes the formatted string again.
+
+    The buffer is flushed when it is full, ``flush()`` is called or the
+    handler is closed, records aren't flushed one by one.
+    """
+
+    terminator = b'\n'
+
+    def __init__(self, filename, mode='ab', buffer_size=None, encoding=None, delay=False):
+        if 'b' not in mode:
+            mode = mode + 'b'
+        self.buffer_size = buffer_size or DEFAULT_BUFFER_SIZE
+        logging.FileHandler.__init__(self, filename, mode, delay=delay)
+        # only used to encode the output of non `JsonFormatter` formatter
+        self.encoding = encoding
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, self.buffer_size)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                # don't truncate the file again after closed
+                if 'w' in self.mode and getattr(self, '_closed', False):
+                    return
+                self.stream = self._open()
+            self.stream.write(_formatBytes(self, record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class JsonBatchFileHandler(JsonFileHandler):
+    """
+    A ``JsonFileHandler`` gathers the formatted lines and writes them to the
+    unbuffered file by one ``write``, when ``batch_records`` records or
+    ``batch_bytes`` bytes are gathered, the first gathered one is older than
+    ``batch_ms`` milliseconds, or a record of ``flush_level`` and above is
+    handled. The batch is also written by ``flush()`` and when the handler
+    is closed (``logging.shutdown`` at exit).
+
+    If ``batch_ms`` is not ``None``, a daemon thread writes the batch older
+    than it even though no more record is handled.
+    """
+
+    def __init__(self, filename, mode='ab', batch_records=1000, batch_bytes=DEFAULT_BUFFER_SIZE, batch_ms=1000, flush_level=logging.ERROR, encoding=None, delay=False):
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.batch_ms = batch_ms
+        self.flush_level = flush_level
+        self.writes = 0
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_since = None
+        JsonFileHandler.__init__(self, filename, mode, encoding=encoding, delay=delay)
+        self._stopped = threading.Event()
+        self._timer = None
+        if batch_ms is not None:
+            self._timer = threading.Thread(target=self._flushStale)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _open(self):
+        # a batch is written by one `write` system call
+        return open(self.baseFilename, self.mode, 0)
+
+    def emit(self, record):
+        try:
+            data = _formatBytes(self, record) + self.terminator
+            self._batch.append(data)
+            self._batch_bytes += len(data)
+            if self._batch_since is None:
+                self._batch_since = _monotonic()
+            if (len(self._batch) >= self.batch_records or
+                    self._batch_bytes >= self.batch_bytes or
+                    record.levelno >= self.flush_level or
+                    self.isStale()):
+                self.writeBatch()
+        except Exception:
+            self.handleError(record)
+
+    def isStale(self):
+        return (self.batch_ms is not None and self._batch_since is not None and
+                (_monotonic() - self._batch_since) * 1000 >= self.batch_ms)
+
+    def writeBatch(self):
+        """
+        Write the gathered lines, the handler lock must be held.
+        """
+        if not self._batch:
+            return
+        if self.stream is None:
+            if 'w' in self.mode and getattr(self, '_closed', False):
+                return
+            self.stream = self._open()
+        data = memoryview(b''.join(self._batch))
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_since = None
+        while data:
+            # the raw file may write part of the data
+            n = self.stream.write(data)
+            if n is None:
+                # compatible python2, `file.write` writes all and returns None
+                break
+            data = data[n:]
+        self.writes += 1
+
+    def flush(self):
+        self.acquire()
+        try:
+            self.writeBatch()
+        finally:
+            self.release()
+
+    def _flushStale(self):
+        interval = self.batch_ms / 1000.0
+        while not self._stopped.wait(interval):
+            if self.isStale():
+                try:
+                    self.flush()
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self):
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        self.flush()
+        JsonFileHandler.close(self)
+
+
+def _replace(src, dst):
+    # compatible python2, windows `os.rename` fails if `dst` exists
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+class JsonRotatingFileHandler(JsonFileHandler):
+    """
+    A ``JsonFileHandler`` rolls the file over when it would be larger than
+    ``max_bytes`` or every ``interval`` seconds (by ``record.created``), the
+    backups are named ``filename.1`` to ``filename.<backup_count>``, with
+    ``.gz`` if ``compress`` is ``True``. If ``backup_count`` is ``0``, the
+    file is never rolled over by size, same as ``RotatingFileHandler``, and
+    all the backups of ``interval`` are kept, same as
+    ``TimedRotatingFileHandler``.
+
+    A record is formatted once, its size is added to the offset tracked by
+    the handler, the file isn't measured on every record. The rolled over
+    file is only renamed by the logging thread, shifting the backups and
+    compressing are done on a background thread.
+    """
+
+    def __init__(self, filename, mode='ab', max_bytes=0, backup_count=0, interval=None, compress=False, buffer_size=None, encoding=None, delay=False):
+        if (backup_count > 0 and max_bytes > 0) or interval:
+            # the file mustn't be truncated after rolled over
+            mode = 'ab'
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.interval = interval
+        self.compress = compress
+        self.offset = 0
+        self.rollover_at = None
+        self._rotations = 0
+        self._rotator = None
+        JsonFileHandler.__init__(
+            self, filename, mode, buffer_size=buffer_size, encoding=encoding, delay=delay)
+
+    def _open(self):
+        stream = JsonFileHandler._open(self)
+        # the position of a file opened in append mode is its end
+        self.offset = stream.tell()
+        return stream
+
+    def shouldRollover(self, record, size):
+        if (self.max_bytes > 0 and self.backup_count > 0 and self.offset and
+                self.offset + size > self.max_bytes):
+            return True
+        if self.interval:
+            if self.rollover_at is None:
+                self.rollover_at = record.created + self.interval
+            elif record.created >= self.rollover_at:
+                return True
+        return False
+
+    def doRollover(self, record=None):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename):
+            self._rotations += 1
+            rotating = '%s.rotating.%d' % (self.baseFilename, self._rotations)
+            _replace(self.baseFilename, rotating)
+            self.rotate(rotating)
+        if self.interval and record is not None:
+            self.rollover_at = record.created + self.interval
+        self.offset = 0
+
+    def rotate(self, path):
+        """
+        Shift the backups and move the rolled over ``path`` to the first one
+        on the background thread.
+        """
+        if self._rotator is None:
+            self._rotator = _Rotator()
+        self._rotator.submit(self.shiftBackups, path)
+
+    def backupName(self, i):
+        return '%s.%d%s' % (self.baseFilename, i, '.gz' if self.compress else '')
+
+    def shiftBackups(self, path):
+        count = self.backup_count
+        if count <= 0:
+            # keep all the backups
+            count = 1
+            while os.path.exists(self.backupName(count)):
+                count += 1
+        for i in range(count - 1, 0, -1):
+            src = self.backupName(i)
+            if os.path.exists(src):
+                _replace(src, self.backupName(i + 1))
+        dst = self.backupName(1)
+        if self.compress:
+            with open(path, 'rb') as f_in:
+                with gzip.open(dst + '.tmp', 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            _replace(dst + '.tmp', dst)
+            os.remove(path)
+        else:
+            _replace(path, dst)
+
+    def emit(self, record):
+        try:
+            data = _formatBytes(self, record) + self.terminator
+            if self.stream is None:
+                if 'w' in self.mode and getattr(self, '_closed', False):
+                    return
+                self.stream = self._open()
+            if self.shouldRollover(record, len(data)):
+                self.doRollover(record)
+                self.stream = self._open()
+            self.stream.write(data)
+            self.offset += len(data)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        JsonFileHandler.close(self)
+        if self._rotator is not None:
+            # the backups are complete after closed
+            self._rotator.stop()
+            self._rotator = None
+
+
+class _Rotator(object):
+    """
+    Run the submitted functions one by one on a daemon thread.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+class JsonQueueListener(object):
+    """
+    Take records from ``queue`` on a worker thread, pass them to ``handlers``
+    to be formatted (e.g. by ``JsonFormatter``) and written there.
+    """
+
+    _sentinel = None
+
+    def __init__(self, queue, handlers, respect_handler_level=False):
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.respect_handler_level = respect_handler_level
+        self._thread = None
+
+    def start(self):
+        self._thread = t = threading.Thread(target=self._monitor)
+        t.daemon = True
+        t.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if not self.respect_handler_level or record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            record = q.get()
+            try:
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+            finally:
+                q.task_done()
+
+    def isAlive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        """
+        Handle all the records already queued, then stop the worker thread
+        and flush ``handlers``.
+        """
+        if self._thread is not None:
+            # block even though the queue is full, the sentinel mustn't lost
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+
+_QUEUE_POLICIES = {
+    'block',
+    'drop'
+}
+
+
+class JsonQueueHandler(logging.Handler):
+    """
+    A handler only puts a snapshot of the record to a bounded queue on the
+    caller thread, ``handlers`` format and write it on the worker thread of a
+    ``JsonQueueListener``, handlers without formatter use ``JsonFormatter()``.
+
+    If the queue is full, ``policy`` ``'block'`` waits for a free slot (up to
+    ``timeout`` seconds if it isn't ``None``), ``'drop'`` drops the record at
+    once, the number of dropped records is counted by ``dropped``.
+
+    ``record_custom_attrs`` are evaluated on the worker thread, attributes
+    read thread local context (e.g. ``flask.request``) should be set to the
+    record by a ``logging.Filter`` of this handler.
+    """
+
+    def __init__(self, handlers, maxsize=10000, policy='block', timeout=None, respect_handler_level=False):
+        if policy not in _QUEUE_POLICIES:
+            raise ValueError('`policy` must be one of: %s' % ','.join(
+                             _QUEUE_POLICIES))
+        logging.Handler.__init__(self)
+        self.queue = Queue(maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+        for handler in handlers:
+            if handler.formatter is None:
+                handler.setFormatter(JsonFormatter())
+        self.listener = JsonQueueListener(
+            self.queue, handlers, respect_handler_level=respect_handler_level)
+        self.listener.start()
+
+    def prepare(self, record):
+        """
+        Return a shallow copy of ``record`` with ``msg`` merged with ``args``,
+        the stored ``extra`` of ``JsonFormatter`` is kept in the copy, the
+        formatting is left to the worker thread.
+        """
+        record = copy.copy(record)
+        if record.args:
+            # the arguments may be changed after logged
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == 'block':
+                self.queue.put(record, True, self.timeout)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """
+        Wait until all the queued records are handled.
+        """
+        if self.listener.isAlive():
+            self.queue.join()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.listener.stop()
+        finally:
+            self.release()
+        logging.Handler.close(self)
+
+
+class _PermanentError(Exception):
+    """The batch is rejected by the endpoint, retrying doesn't help."""
+
+
+def _gzip(data):
+    # compatible python2, no `gzip.compress`
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class _TCPConnection(object):
+    """
+    A persistent TCP connection sends NDJSON lines (the ``json_lines`` codec
+    of Logstash ``tcp`` input).
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+
+    def send(self, payload):
+        if self.sock is None:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.sendall(payload)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+
+class _HTTPConnection(object):
+    """
+    A persistent (keep-alive) HTTP connection posts NDJSON batches (the
+    ``json_lines`` codec of Logstash ``http`` input).
+    """
+
+    def __init__(self, scheme, host, port, path, timeout, compress, headers):
+        self.connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.compress = compress
+        self.headers = {'Content-Type': 'application/x-ndjson'}
+        if compress:
+            self.headers['Content-Encoding'] = 'gzip'
+        self.headers.update(headers or {})
+        self.conn = None
+
+    def send(self, payload):
+        if self.compress:
+            payload = _gzip(payload)
+        if self.conn is None:
+            self.conn = self.connection_class(self.host, self.port, timeout=self.timeout)
+        self.conn.request('POST', self.path, payload, self.headers)
+        response = self.conn.getresponse()
+        response.read()
+        if (response.getheader('connection') or '').lower() == 'close':
+            self.close()
+        if response.status == 429 or response.status >= 500:
+            raise IOError('HTTP %d %s' % (response.status, response.reason))
+        if response.status >= 400:
+            raise _PermanentError('HTTP %d %s' % (response.status, response.reason))
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            finally:
+                self.conn = None
+
+
+_SPILL_POLICIES = {
+    'drop_oldest',
+    'drop_newest',
+    'block'
+}
+
+
+class JsonLogstashHandler(logging.Handler):
+    """
+    A handler ships the records formatted by ``JsonFormatter`` (default
+    ``JsonFormatter()``) as NDJSON to ``url``, ``tcp://host:port`` for the
+    Logstash ``tcp`` input or ``http(s)://host:port/path`` for the ``http``
+    input, both with the ``json_lines`` codec.
+
+    The caller thread only formats the record and puts the bytes to a
+    buffer of at most ``max_buffer_bytes`` bytes, ``workers`` threads send
+    the buffered lines in batches of ``batch_records`` records or
+    ``batch_bytes`` bytes, waiting at most ``batch_ms`` milliseconds for a
+    batch to fill up, every worker keeps its own persistent connection.
+    HTTP batches are gzipped if ``compress`` is ``True``.
+
+    A failed batch is sent again up to ``max_retries`` times, after
+    ``retry_backoff`` seconds doubled for every retry (at most
+    ``max_backoff``), HTTP ``4xx`` responses except ``429`` aren't retried.
+    If the buffer is full (the endpoint is slow or down), ``spill_policy``
+    ``'drop_oldest'`` drops the oldest buffered records, ``'drop_newest'``
+    drops the new record, ``'block'`` waits for free space. ``sent`` and
+    ``dropped`` count the records.
+    """
+
+    def __init__(self, url, batch_records=500, batch_bytes=DEFAULT_BUFFER_SIZE, batch_ms=200, compress=False, workers=1, max_buffer_bytes=16 * 1024 * 1024, spill_policy='drop_oldest', max_retries=5, retry_backoff=0.5, max_backoff=30.0, timeout=10.0, flush_timeout=10.0, headers=None):
+        if spill_policy not in _SPILL_POLICIES:
+            raise ValueError('`spill_policy` must be one of: %s' % ','.join(
+                             _SPILL_POLICIES))
+        parts = urlsplit(url)
+        if parts.scheme not in ('tcp', 'http', 'https'):
+            raise ValueError('`url` must be `tcp://`, `http://` or `https://` one.')
+        if not parts.hostname or (parts.scheme == 'tcp' and parts.port is None):
+            # tcp has no default port
+            raise ValueError('`url` must have the host, and the port if it is `tcp://`.')
+        logging.Handler.__init__(self)
+        self.setFormatter(JsonFormatter())
+        self.url = url
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.batch_ms = batch_ms
+        self.max_buffer_bytes = max_buffer_bytes
+        self.spill_policy = spill_policy
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.flush_timeout = flush_timeout
+        self.sent = 0
+        self.dropped = 0
+
+        if parts.scheme == 'tcp':
+            def make_connection():
+                return _TCPConnection(parts.hostname, parts.port, timeout)
+        else:
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            def make_connection():
+                return _HTTPConnection(
+                    parts.scheme, parts.hostname, parts.port, path, timeout, compress, headers)
+
+        self._buffer = deque()
+        self._buffer_bytes = 0
+        self._inflight = 0
+        self._flushing = 0
+        self._closing = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stopped = threading.Event()
+        self._workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, args=(make_connection(), ))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def emit(self, record):
+        try:
+            self.enqueue(_formatBytes(self, record))
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, data):
+        size = len(data) + 1
+        with self._cond:
+            if self._closing:
+                self.dropped += 1
+                return
+            if self._buffer_bytes + size > self.max_buffer_bytes:
+                if self.spill_policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+                elif self.spill_policy == 'drop_oldest':
+                    while self._buffer and self._buffer_bytes + size > self.max_buffer_bytes:
+                        self._buffer_bytes -= len(self._buffer.popleft()) + 1
+                        self.dropped += 1
+                else:
+                    while (self._buffer and not self._closing and
+                           self._buffer_bytes + size > self.max_buffer_bytes):
+                        self._cond.wait()
+            self._buffer.append(data)
+            self._buffer_bytes += size
+            self._cond.notify_all()
+
+    def takeBatch(self):
+        """
+        Return the next batch of lines for a worker, ``None`` if the handler
+        is closed and nothing is buffered.
+        """
+        with self._cond:
+            while not self._buffer and not self._closing:
+                self._cond.wait()
+            if not self._buffer:
+                return None
+            deadline = _monotonic() + self.batch_ms / 1000.0
+            while (len(self._buffer) < self.batch_records and
+                   self._buffer_bytes < self.batch_bytes and
+                   not self._closing and not self._flushing):
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            size = 0
+            while self._buffer and len(batch) < self.batch_records and size < self.batch_bytes:
+                data = self._buffer.popleft()
+                batch.append(data)
+                size += len(data) + 1
+            self._buffer_bytes -= size
+            self._inflight += 1
+            self._cond.notify_all()
+            return batch
+
+    def send(self, connection, batch):
+        payload = b'\n'.join(batch) + b'\n'
+        retries = 0
+        while True:
+            try:
+                connection.send(payload)
+                sent = True
+                break
+            except _PermanentError:
+                connection.close()
+                sent = False
+                break
+            except Exception:
+                connection.close()
+                if retries >= self.max_retries or self._stopped.is_set():
+                    sent = False
+                    break
+                # the workers mustn't retry at the same time
+                backoff = min(self.max_backoff, self.retry_backoff * 2 ** retries)
+                self._stopped.wait(backoff * random.uniform(0.5, 1))
+                retries += 1
+        with self._cond:
+            if sent:
+                self.sent += len(batch)
+            else:
+                self.dropped += len(batch)
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _work(self, connection):
+        try:
+            while True:
+                batch = self.takeBatch()
+                if batch is None:
+                    break
+                self.send(connection, batch)
+        finally:
+            connection.close()
+
+    def flush(self):
+        """
+        Wait at most ``flush_timeout`` seconds until all the buffered records
+        are sent (or dropped).
+        """
+        deadline = _monotonic() + self.flush_timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._buffer or self._inflight:
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0 or not any(t.is_alive() for t in self._workers):
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._workers:
+                self.flush()
+                with self._cond:
+                    self._closing = True
+                    # records not sent in `flush_timeout`
+                    self.dropped += len(self._buffer)
+                    self._buffer.clear()
+                    self._buffer_bytes = 0
+                    self._cond.notify_all()
+                self._stopped.set()
+                for t in self._workers:
+                    t.join()
+                self._workers = []
+        finally:
+            self.release()
+        logging.Handler.close(self)
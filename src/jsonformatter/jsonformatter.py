@@ -8,13 +8,20 @@ Email: yourname@email.com
 Github: https://github.com/yourname
 Description: jsonformatter.py
 """
+import calendar
 import inspect
 import json
+import linecache
 import logging
+import re
 import sys
+import threading
+import time
+import traceback
 import warnings
-from functools import wraps, partial
-from string import Template
+from collections import OrderedDict
+from functools import partial
+from string import Formatter, Template
 
 # From python3.7, dict is in ordered,so do json package's load(s)/dump(s).
 # https://docs.python.org/3.7/library/stdtypes.html#dict
@@ -22,13 +29,21 @@ from string import Template
 if sys.version_info >= (3, 7):
     dictionary = dict
 else:
-    from collections import OrderedDict
     dictionary = OrderedDict
 
-# compatible python2, python 3  no long type, start
+# compatible python2, python 3  no long/basestring type, start
 if sys.version_info >= (3, 0):
     long = int
-# compatible python2, python 3  no long type, end
+    basestring = str
+# compatible python2, python 3  no long/basestring type, end
+
+# compatible python2, python3.11 `BaseExceptionGroup` start
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+_BaseExceptionGroup = getattr(builtins, 'BaseExceptionGroup', None)
+# compatible python2, python3.11 `BaseExceptionGroup` end
 
 
 class PercentStyle(object):
@@ -42,8 +57,18 @@ class PercentStyle(object):
     def usesTime(self):
         return self._fmt.find(self.asctime_search) >= 0
 
-    def format(self, record):
-        return self._fmt % record.__dict__
+    def isTemplate(self, value):
+        return '%' in value
+
+    def fieldNames(self, value):
+        return set(re.findall(r'%\(([^)]*)\)', value))
+
+    def format(self, record, fmt=None):
+        # `fmt` is passed in for every call, so one style can be shared by
+        # threads, `self._fmt` is only the fallback
+        if fmt is None:
+            fmt = self._fmt
+        return fmt % record.__dict__
 
 
 class StrFormatStyle(PercentStyle):
@@ -51,8 +76,22 @@ class StrFormatStyle(PercentStyle):
     asctime_format = '{asctime}'
     asctime_search = '{asctime'
 
-    def format(self, record):
-        return self._fmt.format(**record.__dict__)
+    def isTemplate(self, value):
+        return '{' in value or '}' in value
+
+    def fieldNames(self, value):
+        names = set()
+        for _, field_name, format_spec, _ in Formatter().parse(value):
+            if field_name:
+                names.add(re.split(r'[.\[]', field_name)[0])
+            if format_spec:
+                names.update(self.fieldNames(format_spec))
+        return names
+
+    def format(self, record, fmt=None):
+        if fmt is None:
+            fmt = self._fmt
+        return fmt.format(**record.__dict__)
 
 
 class StringTemplateStyle(PercentStyle):
@@ -70,8 +109,23 @@ class StringTemplateStyle(PercentStyle):
         fmt = self._fmt
         return fmt.find('$asctime') >= 0 or fmt.find(self.asctime_format) >= 0
 
-    def format(self, record):
-        return self._tpl[self._fmt].substitute(**record.__dict__)
+    def isTemplate(self, value):
+        return '$' in value
+
+    def fieldNames(self, value):
+        return set(
+            m.group('named') or m.group('braced')
+            for m in Template.pattern.finditer(value)
+            if m.group('named') or m.group('braced')
+        )
+
+    def format(self, record, fmt=None):
+        if fmt is None:
+            fmt = self._fmt
+        tpl = self._tpl.get(fmt)
+        if tpl is None:
+            tpl = self._tpl[fmt] = Template(fmt)
+        return tpl.substitute(**record.__dict__)
 
 
 BASIC_FORMAT = dictionary([
@@ -111,12 +165,566 @@ _LogRecordDefaultAttributes = {
     'asctime'
 }
 
+# time attributes set to `LogRecord` by `JsonFormatter` when `fmt` uses them
+_TIME_ATTRIBUTES = (
+    'asctime',
+    'iso8601',
+    'iso8601_utc',
+    'rfc3339',
+    'epoch_ms',
+    'epoch_ns'
+)
+
+# exception attributes set to `LogRecord` by `JsonFormatter` when `fmt` uses them
+_EXC_ATTRIBUTES = (
+    'exc_type',
+    'exc_message',
+    'exc_frames',
+    'stack_frames'
+)
+
+# attributes of `LogRecord` itself, the other attributes are `extra`
+_RECORD_ATTRIBUTES = _LogRecordDefaultAttributes.union(_TIME_ATTRIBUTES, _EXC_ATTRIBUTES)
+
+# the key of `LogRecord` stores the names of the attributes set by
+# `JsonFormatter` (except `message` and `asctime`), they aren't `extra`
+_SET_ATTRS_KEY = '_JsonFormatter__set_attrs'
+
+# a frame of `LogRecord.stack_info`, the source line follows it if available
+_STACK_FRAME_RE = re.compile(r'^  File "(.*)", line (\d+), in (.*)(?:\n    (\S.*))?', re.M)
+
 _MIX_EXTRA_ORDER = {
     'head',
     'tail',
     'mix'
 }
 
+# kinds of compiled `fmt` field, see `JsonFormatter.compileFmt`
+# `LogRecord` attribute (or `extra` key), output the value itself
+_FIELD_ATTR = 0
+# attribute set by `record_custom_attrs`
+_FIELD_CUSTOM = 1
+# `style` template, output the rendered string
+_FIELD_TEMPLATE = 2
+# not a string, output as it is
+_FIELD_CONSTANT = 3
+
+# `json.dumps` parameters stored in `JsonFormatter`, setting any of them
+# rebuilds the cached `JSONEncoder`
+_JSON_DUMPS_PARAMS = {
+    'skipkeys',
+    'ensure_ascii',
+    'check_circular',
+    'allow_nan',
+    'cls',
+    'indent',
+    'separators',
+    'default',
+    'sort_keys',
+    'kw'
+}
+
+# the cached encoder is built again when these parameters are set
+_ENCODER_PARAMS = _JSON_DUMPS_PARAMS | {
+    'encoding',
+    'max_message_length',
+    'max_value_length',
+    'max_line_bytes'
+}
+
+# the key marks the output is truncated by the size limits
+_TRUNCATED_KEY = 'truncated'
+
+
+_INFINITY = float('inf')
+
+# compatible python2, no `time.monotonic` start
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# compatible python2, python3.6 no `time.perf_counter_ns` start
+if hasattr(time, 'perf_counter_ns'):
+    _perf_counter_ns = time.perf_counter_ns
+else:
+    _perf_counter = getattr(time, 'perf_counter', time.time)
+
+    def _perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+# compatible python2, python3.6 no `time.perf_counter_ns` end
+# compatible python2, no `time.monotonic` end
+
+_MISSING = object()
+
+
+_logger = logging.getLogger(__name__)
+
+
+class _LRUCache(object):
+    """
+    A thread safe cache keeps at most ``maxsize`` items, the least recently
+    used one is evicted.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _MISSING)
+            if value is _MISSING:
+                return default
+            # the most recently used one is at the end
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedCustomAttr(object):
+    """
+    Wrap a ``record_custom_attrs`` function without parameters, the value it
+    returned is cached instead of calling it for every record.
+
+    The cache scope is:
+
+    - ``ttl`` and ``key`` are ``None``: process constant, ``func`` is called
+      once, e.g. hostname, service version.
+    - ``ttl`` is seconds: the value is called again after ``ttl`` seconds.
+    - ``key`` is a ``contextvars.ContextVar`` (or any object has ``get()``)
+      or a function without parameters: one value is cached for every key,
+      e.g. the request id of current request, at most ``maxsize`` values
+      are cached, the least recently used one is evicted.
+
+    ``ttl`` and ``key`` can be used together.
+    """
+
+    def __init__(self, func, ttl=None, key=None, maxsize=128):
+        if not callable(func):
+            raise TypeError('`%s` is not callable.' % func)
+        if key is not None and not (callable(key) or hasattr(key, 'get')):
+            raise TypeError('`key` must be callable or `contextvars.ContextVar`.')
+        self.func = func
+        self.ttl = ttl
+        self.key = key
+        self.maxsize = maxsize
+        self._value = _MISSING
+        self._cache = _LRUCache(maxsize)
+
+    def getKey(self):
+        key = self.key
+        if hasattr(key, 'get'):
+            return key.get(None)
+        return key()
+
+    def __call__(self):
+        if self.key is None and self.ttl is None:
+            value = self._value
+            if value is _MISSING:
+                value = self._value = self.func()
+            return value
+
+        key = None if self.key is None else self.getKey()
+        now = _monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0] > now):
+            return cached[1]
+        value = self.func()
+        self._cache.set(key, (None if self.ttl is None else now + self.ttl, value))
+        return value
+
+    def clear(self):
+        self._value = _MISSING
+        self._cache.clear()
+
+
+_CAUSE_MESSAGE = (
+    '\nThe above exception was the direct cause of the following exception:\n\n')
+_CONTEXT_MESSAGE = (
+    '\nDuring handling of the above exception, another exception occurred:\n\n')
+
+
+def _exception_chain(exc, tb):
+    """
+    Return ``[(chain message, exception, traceback)]`` of ``exc``, the oldest
+    exception is the first, chained as ``traceback.print_exception`` does.
+    """
+    chain = []
+    seen = set()
+    while exc is not None:
+        seen.add(id(exc))
+        cause = exc.__cause__
+        context = exc.__context__
+        if cause is not None and id(cause) not in seen:
+            message, chained = _CAUSE_MESSAGE, cause
+        elif context is not None and not exc.__suppress_context__ and id(context) not in seen:
+            message, chained = _CONTEXT_MESSAGE, context
+        else:
+            message, chained = None, None
+        chain.append((message, exc, tb))
+        exc = chained
+        tb = getattr(chained, '__traceback__', None)
+    chain.reverse()
+    return chain
+
+
+def _traceback_locations(tb):
+    """
+    Return the code locations of ``tb``, they decide the formatted traceback
+    except the exception message.
+    """
+    locations = []
+    while tb is not None:
+        locations.append((tb.tb_frame.f_code, tb.tb_lasti))
+        tb = tb.tb_next
+    return tuple(locations)
+
+
+def _exception_type_name(exc_type):
+    name = getattr(exc_type, '__qualname__', exc_type.__name__)
+    module = exc_type.__module__
+    if module not in ('__main__', 'builtins', 'exceptions'):
+        name = module + '.' + name
+    return name
+
+
+def _truncate(value, limit):
+    """
+    Return ``value`` cut to at most ``limit`` characters (string) or items
+    (``list``, ``tuple`` and ``dict``, the nested ones too), and whether it
+    is cut.
+    """
+    if isinstance(value, basestring):
+        if len(value) > limit:
+            return value[:limit], True
+        return value, False
+    if isinstance(value, dict):
+        truncated = len(value) > limit
+        items = []
+        for k, v in value.items():
+            if len(items) == limit:
+                break
+            v, cut = _truncate(v, limit)
+            truncated = truncated or cut
+            items.append((k, v))
+        if truncated:
+            return dictionary(items), True
+        return value, False
+    if isinstance(value, (list, tuple)):
+        truncated = len(value) > limit
+        items = []
+        for v in value[:limit]:
+            v, cut = _truncate(v, limit)
+            truncated = truncated or cut
+            items.append(v)
+        if truncated:
+            return items, True
+        return value, False
+    return value, False
+
+
+def _size_of(ensure_ascii, encoding):
+    """
+    Return the function measures the encoded bytes of an encoded JSON string.
+    """
+    if ensure_ascii:
+        return len
+    return lambda s: len(s.encode(encoding, 'backslashreplace'))
+
+
+def _fit_string(encode_str, value, remaining, size_of):
+    """
+    Return the longest head of ``value`` and its encoded JSON string at most
+    ``remaining`` bytes, ``None`` if even the empty string isn't.
+    """
+    if remaining < 2:
+        return None
+    # every character is at least one byte, besides the quotes
+    n = min(len(value), remaining - 2)
+    while True:
+        encoded = encode_str(value[:n])
+        size = size_of(encoded)
+        if size <= remaining:
+            return value[:n], encoded
+        if n == 0:
+            return None
+        # escaped characters are longer than one byte
+        n = min(n - 1, n * remaining // size)
+
+
+def _never_fits(value, remaining):
+    """
+    Return ``True`` if encoded ``value`` is surely over ``remaining`` bytes,
+    it is worked out without encoding ``value``: every character of a string
+    and every item of a container is one byte at least.
+    """
+    if isinstance(value, basestring):
+        return len(value) + 2 > remaining
+    if isinstance(value, (list, tuple, dict)):
+        return _truncate(value, remaining)[1]
+    return False
+
+
+def _make_line_encoder(encoder, keys, max_bytes=None, truncation=None, encoding='utf-8'):
+    """
+    Return a function joins the values of ``keys`` to a JSON object line, the
+    keys and separators are encoded once. Same as ``encoder.encode`` a dict,
+    only the values are encoded for every record. ``None`` is returned if
+    ``encoder`` can't be assembled this way.
+
+    If ``truncation`` is not ``None``, ``"truncated": true`` is appended when
+    ``truncation.cut`` is set, values over ``max_bytes`` of the line are cut
+    (strings) or ``null`` while they are encoded.
+    """
+    # compatible python2, `str` needs decoding by `encoding` in python2
+    if sys.version_info < (3, 0):
+        return None
+    if type(encoder) is not json.JSONEncoder or encoder.indent is not None or encoder.sort_keys:
+        return None
+    if not all(isinstance(k, str) for k in keys):
+        return None
+    if truncation is not None and _TRUNCATED_KEY in keys:
+        # the marker replaces the value of the key in the dict
+        return None
+
+    if encoder.ensure_ascii:
+        encode_str = json.encoder.encode_basestring_ascii
+    else:
+        encode_str = json.encoder.encode_basestring
+    encode = encoder.encode
+    item_separator = encoder.item_separator
+    fragments = [encode_str(k) + encoder.key_separator for k in keys]
+    marker = encode_str(_TRUNCATED_KEY) + encoder.key_separator + 'true'
+
+    if max_bytes is not None:
+        return _make_fitted_line_encoder(
+            encoder, encode_str, fragments, marker, max_bytes, truncation, encoding)
+
+    def encode_line(values):
+        parts = []
+        append = parts.append
+        for fragment, value in zip(fragments, values):
+            value_type = type(value)
+            if value_type is str:
+                append(fragment + encode_str(value))
+            elif value is None:
+                append(fragment + 'null')
+            elif value is True:
+                append(fragment + 'true')
+            elif value is False:
+                append(fragment + 'false')
+            elif value_type is int:
+                append(fragment + int.__repr__(value))
+            elif value_type is float and -_INFINITY < value < _INFINITY:
+                append(fragment + float.__repr__(value))
+            else:
+                append(fragment + encode(value))
+        if truncation is not None and truncation.cut:
+            append(marker)
+        return '{' + item_separator.join(parts) + '}'
+
+    return encode_line
+
+
+def _make_fitted_line_encoder(encoder, encode_str, fragments, marker, max_bytes, truncation, encoding):
+    """
+    The line encoder of ``_make_line_encoder`` keeps the line at most
+    ``max_bytes`` bytes, the size of the marker is always reserved.
+    """
+    encode = encoder.encode
+    item_separator = encoder.item_separator
+    size_of = _size_of(encoder.ensure_ascii, encoding)
+    fragment_sizes = [size_of(fragment) for fragment in fragments]
+    separator_size = size_of(item_separator)
+    reserved = 2 + separator_size + size_of(marker)
+
+    def encode_value(value):
+        value_type = type(value)
+        if value_type is str:
+            return encode_str(value)
+        elif value is None:
+            return 'null'
+        elif value is True:
+            return 'true'
+        elif value is False:
+            return 'false'
+        elif value_type is int:
+            return int.__repr__(value)
+        elif value_type is float and -_INFINITY < value < _INFINITY:
+            return float.__repr__(value)
+        return encode(value)
+
+    def encode_line(values):
+        parts = []
+        size = reserved
+        for fragment, fragment_size, value in zip(fragments, fragment_sizes, values):
+            remaining = max_bytes - size - fragment_size - (separator_size if parts else 0)
+            if _never_fits(value, remaining):
+                # a huge value is never encoded in full
+                encoded_size = None
+            else:
+                encoded = encode_value(value)
+                encoded_size = size_of(encoded)
+            if encoded_size is None or encoded_size > remaining:
+                truncation.cut = True
+                if isinstance(value, str):
+                    fitted = _fit_string(encode_str, value, remaining, size_of)
+                    encoded = fitted and fitted[1]
+                else:
+                    encoded = 'null' if remaining >= 4 else None
+                if encoded is None:
+                    # even `null` is too long, the key is left out
+                    continue
+                encoded_size = size_of(encoded)
+            size += fragment_size + encoded_size + (separator_size if parts else 0)
+            parts.append(fragment + encoded)
+        if truncation.cut:
+            parts.append(marker)
+        return '{' + item_separator.join(parts) + '}'
+
+    return encode_line
+
+
+# phases of `format` timed by `collect_stats`
+_STATS_PHASES = (
+    'message',
+    'time',
+    'exception',
+    'extra',
+    'custom_attrs',
+    'fields'
+)
+
+# indexes of `collect_stats` counters: the records, output bytes, timed
+# records and their nanoseconds of `format`, then the count and nanoseconds
+# of every phase of the timed records
+_STATS_RECORDS = 0
+_STATS_OUTPUT = 1
+_STATS_TIMED = 2
+_STATS_FORMAT = 3
+(_STATS_MESSAGE, _STATS_TIME, _STATS_EXCEPTION, _STATS_EXTRA,
+ _STATS_CUSTOM_ATTRS, _STATS_FIELDS) = range(4, 4 + 2 * len(_STATS_PHASES), 2)
+_STATS_SIZE = 4 + 2 * len(_STATS_PHASES)
+
+# one of every `_STATS_SAMPLE` records of a thread is timed, reading the
+# clock costs more than counting
+_STATS_SAMPLE = 16
+
+# compatible python2, python3.6 no `str.isascii` start
+if hasattr(str, 'isascii'):
+    _is_ascii = str.isascii
+else:
+    _NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+    def _is_ascii(s):
+        return _NON_ASCII_RE.search(s) is None
+# compatible python2, python3.6 no `str.isascii` end
+
+
+def _count_phase(counters, phase, start):
+    """
+    Count ``phase`` began at ``start`` nanoseconds, return the time it ends.
+    """
+    now = _perf_counter_ns()
+    counters[phase] += 1
+    counters[phase + 1] += now - start
+    return now
+
+
+class _FormatStats(object):
+    """
+    Counters of ``JsonFormatter.format``, every thread updates its own
+    counters without lock, they are summed by ``snapshot``. The counters of
+    ended threads are added to ``_ended`` when a new thread counts, so only
+    the live threads keep their own ones.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # `[(thread, counters)]`
+        self._all = []
+        self._ended = [0] * _STATS_SIZE
+
+    def counters(self):
+        """
+        Return the counters list of current thread.
+        """
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = [0] * _STATS_SIZE
+            with self._lock:
+                alive = []
+                for thread, thread_counters in self._all:
+                    if thread.is_alive():
+                        alive.append((thread, thread_counters))
+                    else:
+                        for i, value in enumerate(thread_counters):
+                            self._ended[i] += value
+                alive.append((threading.current_thread(), counters))
+                self._all = alive
+        return counters
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            total = list(self._ended)
+            if reset:
+                self._ended = [0] * _STATS_SIZE
+            for _, counters in self._all:
+                for i, value in enumerate(counters):
+                    total[i] += value
+                    if reset:
+                        counters[i] = 0
+        return total
+
+
+class _FmtProfile(object):
+    """
+    A compiled ``fmt`` and the settings it is output with, ``mix_extra`` and
+    ``mix_extra_position`` are ``None`` if they are the formatter's.
+    """
+
+    def __init__(self, json_fmt, fields, custom_attr_calls, skipped_custom_attrs, uses, mix_extra=None, mix_extra_position=None):
+        self.json_fmt = json_fmt
+        self.fields = fields
+        self.keys = [k for k, _, _ in fields]
+        # keys output `extra` or custom attributes, limited by `max_value_length`
+        self.value_keys = frozenset(
+            k for k, kind, v in fields
+            if kind == _FIELD_CUSTOM or kind == _FIELD_ATTR and v not in _RECORD_ATTRIBUTES)
+        self.custom_attr_calls = custom_attr_calls
+        self.skipped_custom_attrs = skipped_custom_attrs
+        self.uses_message = 'message' in uses or 'exc_text' in uses
+        self.time_attrs = [attr for attr in _TIME_ATTRIBUTES if attr in uses]
+        self.exc_attrs = [attr for attr in _EXC_ATTRIBUTES if attr in uses]
+        # attributes set to `LogRecord` besides the standard ones
+        self.set_attrs = frozenset(
+            attr for attr in self.time_attrs + self.exc_attrs if attr != 'asctime')
+        self.mix_extra = mix_extra
+        self.mix_extra_position = mix_extra_position
+        # `(encoder, line encoder)`
+        self.line_encoder = (None, None)
+
+
+# options can be set for a profile of `level_fmts`
+_PROFILE_OPTIONS = {
+    'record_custom_attrs',
+    'mix_extra',
+    'mix_extra_position'
+}
+
 
 class JsonFormatter(logging.Formatter):
     """
@@ -158,6 +766,18 @@ class JsonFormatter(logging.Formatter):
     %(process)d         Process ID (if available)
     %(message)s         The result of record.getMessage(), computed just as
                         the record is emitted
+
+    Besides, ``JsonFormatter`` supports these time attributes:
+
+    %(iso8601)s         ISO-8601 local time with milliseconds and UTC offset,
+                        e.g. 2003-07-08T16:49:45.896+08:00
+    %(iso8601_utc)s     ISO-8601 UTC time with milliseconds,
+                        e.g. 2003-07-08T08:49:45.896Z
+    %(rfc3339)s         RFC 3339 local time with microseconds and UTC offset,
+                        e.g. 2003-07-08T16:49:45.896123+08:00
+    %(epoch_ms)d        Integer milliseconds since the epoch
+    %(epoch_ns)d        Integer nanoseconds since the epoch (precision is
+                        limited by the float ``created``)
     """
 
     def parseFmt(self, fmt):
@@ -174,18 +794,21 @@ class JsonFormatter(logging.Formatter):
                 '`%s` type is not supported, `fmt` must be `json`, `OrderedDcit` or `dict` type. ' % type(fmt))
 
     def checkRecordCustomAttrs(self, record_custom_attrs):
-        def _patch_no_params_func_accept_kwargs(func):
-            @wraps(func)
-            def wrapper(*args, **kwargs):
-                return func(*args)
-            return wrapper
-
+        """
+        Check ``record_custom_attrs``, return ``[(attr, func, params)]``.
+        ``params`` is the names of keyword only parameters ``func`` declares,
+        only these `LogRecord` attributes are passed to ``func``, an empty
+        tuple means no parameters, ``None`` means all attributes are passed
+        (``**kwargs`` function or callable can't be inspected).
+        """
+        calls = []
         if record_custom_attrs:
             if isinstance(record_custom_attrs, dict):
                 for attr, func in record_custom_attrs.items():
                     if not callable(func):
                         raise TypeError('`%s` is not callable.' % func)
 
+                    params = None
                     if inspect.isfunction(func):
                         argspec = (getattr(inspect, 'getfullargspec', None) or inspect.getargspec)(func)
                         if argspec.args:
@@ -197,9 +820,9 @@ class JsonFormatter(logging.Formatter):
                                 getattr(argspec, 'keywords', False) or
                                     getattr(argspec, 'varkw', False)
                             ):
-                                record_custom_attrs[attr] = _patch_no_params_func_accept_kwargs(
-                                    func
-                                )
+                                params = tuple(getattr(argspec, 'kwonlyargs', None) or ())
+                    elif isinstance(func, CachedCustomAttr):
+                        params = ()
                     else:
                         if isinstance(func, partial):
                             warnings.warn(
@@ -210,12 +833,153 @@ class JsonFormatter(logging.Formatter):
                         else:
                             warnings.warn(
                                 "`%s` is a unknown callable type, please make sure no positional parameters in function/method signature." % (func), UserWarning)
+                    calls.append((attr, func, params))
             else:
                 raise TypeError('`record_custom_attrs` must be `dict` type.')
+        return calls
+
+    def compileFmt(self, json_fmt, record_custom_attrs=None):
+        """
+        Compile ``json_fmt`` to a list of ``(key, kind, value)`` fields, so
+        ``format`` needn't analyse the ``fmt`` for every record.
+        """
+        custom_attrs = record_custom_attrs or {}
+        fields = []
+        for k, v in json_fmt.items():
+            if not isinstance(v, basestring):
+                kind = _FIELD_CONSTANT
+            elif v in custom_attrs:
+                kind = _FIELD_CUSTOM
+            elif self._style.isTemplate(v):
+                kind = _FIELD_TEMPLATE
+            else:
+                kind = _FIELD_ATTR
+            fields.append((k, kind, v))
+        return fields
+
+    def compileProfile(self, json_fmt, record_custom_attrs=None, mix_extra=None, mix_extra_position=None):
+        """
+        Compile ``json_fmt`` and work out the `LogRecord` attributes and
+        ``record_custom_attrs`` the output needs.
+        """
+        custom_attr_calls = self.checkRecordCustomAttrs(record_custom_attrs)
+        fields = self.compileFmt(json_fmt, record_custom_attrs)
+
+        uses = self.fieldsUses(fields)
+        if uses is None:
+            uses = set(_RECORD_ATTRIBUTES)
         else:
-            return
+            uses = set(uses)
+            custom_attr_calls = self.reachableCustomAttrCalls(custom_attr_calls, uses)
+        reached = set(attr for attr, _, _ in custom_attr_calls)
+        skipped_custom_attrs = [
+            attr for attr in (record_custom_attrs or ())
+            if attr not in reached
+        ]
+        if skipped_custom_attrs:
+            _logger.debug(
+                '`record_custom_attrs` %s are skipped, `fmt` never outputs them.',
+                skipped_custom_attrs)
+        return _FmtProfile(
+            json_fmt, fields, custom_attr_calls, skipped_custom_attrs, uses,
+            mix_extra, mix_extra_position)
+
+    def compileLevelFmts(self, level_fmts):
+        """
+        Compile ``level_fmts`` to ``[(low, high, profile)]``, sorted by
+        ``low``, ranges are before levels.
+        """
+        def _level(level):
+            if isinstance(level, basestring):
+                level = logging.getLevelName(level)
+            if not isinstance(level, (int, long)):
+                raise ValueError('Unknown level: %r' % (level, ))
+            return level
+
+        ranges = []
+        levels = []
+        for level, fmt in (level_fmts or {}).items():
+            options = {}
+            if isinstance(fmt, tuple):
+                fmt, options = fmt
+                for option in options:
+                    if option not in _PROFILE_OPTIONS:
+                        raise ValueError('`%s` can\'t be set for a level, options must be one of: %s' % (
+                            option, ','.join(_PROFILE_OPTIONS)))
+                if options.get('mix_extra_position', 'tail') not in _MIX_EXTRA_ORDER:
+                    raise ValueError('`mix_extra_position` must be one of: %s' % ','.join(
+                                     _MIX_EXTRA_ORDER))
+            profile = self.compileProfile(
+                self.parseFmt(fmt),
+                options.get('record_custom_attrs', self.record_custom_attrs),
+                options.get('mix_extra'),
+                options.get('mix_extra_position')
+            )
+            if isinstance(level, tuple):
+                ranges.append((_level(level[0]), _level(level[1]), profile))
+            else:
+                levels.append([_level(level), None, profile])
+        levels.sort(key=lambda x: x[0])
+        # a level applies up to the next level
+        for current, following in zip(levels, levels[1:]):
+            current[1] = following[0] - 1
+        return ranges + [tuple(level) for level in levels]
+
+    def getProfile(self, record):
+        """
+        Return the profile of ``record.levelno``, it is cached for every level.
+        """
+        if not self._level_profiles:
+            return self._profile
+        levelno = record.levelno
+        profile = self._profiles_by_level.get(levelno)
+        if profile is None:
+            profile = self._profile
+            for low, high, level_profile in self._level_profiles:
+                if low <= levelno and (high is None or levelno <= high):
+                    profile = level_profile
+                    break
+            self._profiles_by_level[levelno] = profile
+        return profile
+
+    def reachableCustomAttrCalls(self, calls, uses):
+        """
+        Return the ``calls`` of ``checkRecordCustomAttrs`` which ``uses`` reach,
+        ``uses`` is updated with the attributes these calls read.
+        """
+        reachable = []
+        reach_all = False
+        # a custom attribute only reads the ones set before it
+        for attr, func, params in reversed(calls):
+            if not (reach_all or attr in uses):
+                continue
+            reachable.append((attr, func, params))
+            if params is None:
+                # `**kwargs` one may read any attribute of `LogRecord`
+                uses.update(('message', 'asctime'))
+                reach_all = True
+            else:
+                uses.update(params)
+        reachable.reverse()
+        return reachable
 
-    def __init__(self, fmt=BASIC_FORMAT, datefmt=None, style='%', record_custom_attrs=None, mix_extra=False, mix_extra_position='tail', skipkeys=False, ensure_ascii=True, check_circular=True, allow_nan=True, cls=None, indent=None, separators=None, encoding='utf-8', default=None, sort_keys=False, **kw):
+    def fieldsUses(self, fields):
+        """
+        Return the names of `LogRecord` attributes the compiled ``fields``
+        read, ``None`` if it can't be worked out.
+        """
+        uses = set()
+        for _, kind, v in fields:
+            if kind == _FIELD_TEMPLATE:
+                try:
+                    uses.update(self._style.fieldNames(v))
+                except ValueError:
+                    return None
+            elif kind != _FIELD_CONSTANT:
+                uses.add(v)
+        return uses
+
+    def __init__(self, fmt=BASIC_FORMAT, datefmt=None, style='%', record_custom_attrs=None, mix_extra=False, mix_extra_position='tail', skipkeys=False, ensure_ascii=True, check_circular=True, allow_nan=True, cls=None, indent=None, separators=None, encoding='utf-8', default=None, sort_keys=False, level_fmts=None, exc_cache_size=128, exc_max_frames=None, structured_exc=False, exc_source_lines=False, max_message_length=None, max_value_length=None, max_line_bytes=None, collect_stats=False, **kw):
         """
         If ``style`` not in ``['%', '{', '$']``, a ``ValueError`` will be raised.
 
@@ -232,6 +996,42 @@ class JsonFormatter(logging.Formatter):
         If ``mix_extra_position`` not in ``['head', 'tail' or 'mix']``, a
         ``ValueError`` will be raised.
 
+        If ``level_fmts`` is not ``None``, it maps a level (e.g.
+        ``logging.ERROR`` or ``'ERROR'``) or an inclusive level range (e.g.
+        ``(logging.DEBUG, logging.INFO)``) to a ``fmt`` for the records of
+        these levels. A level applies to its records and above, up to the next
+        level in the mapping, ranges take precedence over levels, records no
+        level matches use ``fmt``. The value can also be a tuple
+        ``(fmt, options)``, ``options`` is a ``dict`` may set
+        ``record_custom_attrs``, ``mix_extra`` and ``mix_extra_position`` for
+        these levels, otherwise they are same with the formatter's.
+
+        The formatted traceback (except the exception messages) is cached by
+        the exception types and code locations of the traceback, at most
+        ``exc_cache_size`` ones, ``0`` disables the cache. If
+        ``exc_max_frames`` is not ``None``, only the most recent
+        ``exc_max_frames`` frames of a traceback are output.
+
+        If ``structured_exc`` is ``True``, the traceback and ``stack_info``
+        aren't joined into ``message``, output them by ``exc_type``,
+        ``exc_message``, ``exc_frames`` and ``stack_frames`` instead, the
+        frames have source ``line`` only if ``exc_source_lines`` is ``True``.
+        A ``fmt`` outputs none of them still joins them into ``message``, the
+        traceback isn't lost.
+
+        ``max_message_length`` limits the characters of ``message``,
+        ``max_value_length`` limits the characters of string values and the
+        items of ``list``, ``tuple`` and ``dict`` values of extra, custom
+        attributes and the results of ``default``, the attributes of
+        ``LogRecord`` and templates aren't limited, ``max_line_bytes`` limits
+        the encoded bytes of the output, values over it are cut or ``null``
+        while they are encoded, a ``ValueError`` will be raised if it is used
+        with ``indent``. The output of a cut record has ``"truncated": true``.
+
+        If ``collect_stats`` is ``True``, the count and nanoseconds of every
+        phase of ``format`` (timed on a sample of the records) and the output
+        bytes are counted, read them by ``stats()``.
+
         If ``skipkeys`` is true then ``dict`` keys that are not basic types
         (``str``, ``int``, ``float``, ``bool``, ``None``) will be skipped
         instead of raising a ``TypeError``.
@@ -279,6 +1079,9 @@ class JsonFormatter(logging.Formatter):
         if mix_extra_position not in _MIX_EXTRA_ORDER:
             raise ValueError('`mix_extra_position` must be one of: %s' % ','.join(
                              _MIX_EXTRA_ORDER))
+        if max_line_bytes is not None and indent is not None:
+            # the indented line is longer than the measured one
+            raise ValueError('`max_line_bytes` can\'t be used with `indent`.')
         # compatible python2 start
         if sys.version_info < (3, 0):
             kw.update(encoding=encoding)
@@ -296,7 +1099,12 @@ class JsonFormatter(logging.Formatter):
         self.mix_extra = mix_extra
         self.mix_extra_position = mix_extra_position
 
-        self.checkRecordCustomAttrs(self.record_custom_attrs)
+        # only prepare the `LogRecord` attributes the output needs
+        self._profile = self.compileProfile(self.json_fmt, self.record_custom_attrs)
+        self.skipped_custom_attrs = self._profile.skipped_custom_attrs
+        self.level_fmts = level_fmts
+        self._level_profiles = self.compileLevelFmts(level_fmts)
+        self._profiles_by_level = {}
 
         # support `json.dumps` parameters start
         self.skipkeys = skipkeys
@@ -312,7 +1120,141 @@ class JsonFormatter(logging.Formatter):
         self.kw = kw
         # support `json.dumps` parameters end
 
-    def setRecordMessage(self, record):
+        # formatted seconds of time attributes, `{key: (second, string)}`
+        self._time_cache = {}
+
+        self.exc_cache_size = exc_cache_size
+        self.exc_max_frames = exc_max_frames
+        self.structured_exc = structured_exc
+        self.exc_source_lines = exc_source_lines
+
+        self.max_message_length = max_message_length
+        self.max_value_length = max_value_length
+        self.max_line_bytes = max_line_bytes
+        # `cut` is set if the record formatting in this thread is truncated
+        self._truncation = threading.local()
+
+        self._stats = None
+        if collect_stats:
+            self.enableStats()
+        # formatted tracebacks except the exception messages
+        self._exc_cache = _LRUCache(exc_cache_size)
+
+    def __setattr__(self, name, value):
+        if name in _ENCODER_PARAMS:
+            self.__dict__['_encoder'] = None
+        logging.Formatter.__setattr__(self, name, value)
+
+    def getEncoder(self):
+        """
+        Return the ``JSONEncoder`` built from the ``json.dumps`` parameters,
+        it is cached until one of the parameters is set again. Changing
+        ``kw`` in place needs ``self.kw = self.kw`` to take effect.
+        """
+        encoder = self.__dict__.get('_encoder')
+        if encoder is None:
+            encoder = (self.cls or json.JSONEncoder)(
+                skipkeys=self.skipkeys,
+                ensure_ascii=self.ensure_ascii,
+                check_circular=self.check_circular,
+                allow_nan=self.allow_nan,
+                indent=self.indent,
+                separators=self.separators,
+                default=self.default,
+                sort_keys=self.sort_keys,
+                **self.kw
+            )
+            if self.__dict__.get('max_value_length') is not None:
+                # the results of `default` are limited too
+                default = encoder.default
+                encoder.default = lambda o: self.truncateValue(default(o))
+            self.__dict__['_encoder'] = encoder
+        return encoder
+
+    def getLineEncoder(self, profile=None):
+        """
+        Return the function encodes the values of ``fmt`` keys to the same
+        line as ``getEncoder().encode`` the dict, ``None`` if the encoder
+        options need the dict (e.g. ``cls``, ``indent`` or ``sort_keys``).
+        """
+        profile = profile or self._profile
+        encoder = self.getEncoder()
+        line_encoder = profile.line_encoder
+        if line_encoder[0] is not encoder:
+            line_encoder = profile.line_encoder = (
+                encoder, _make_line_encoder(
+                    encoder, profile.keys, self.max_line_bytes,
+                    self._truncation if self.isLimited() else None, self.encoding))
+        return line_encoder[1]
+
+    def isLimited(self):
+        return (self.max_message_length is not None or
+                self.max_value_length is not None or
+                self.max_line_bytes is not None)
+
+    def truncateValue(self, value):
+        """
+        Return ``value`` limited by ``max_value_length``.
+        """
+        if self.max_value_length is None:
+            return value
+        value, cut = _truncate(value, self.max_value_length)
+        if cut:
+            self._truncation.cut = True
+        return value
+
+    def truncateValues(self, keys, values, value_keys):
+        """
+        Return ``values`` of ``keys``, the values of ``value_keys`` are
+        limited by ``max_value_length``.
+        """
+        return [
+            self.truncateValue(v) if k in value_keys else v
+            for k, v in zip(keys, values)
+        ]
+
+    def truncateMessage(self, record):
+        message = record.message
+        if isinstance(message, basestring) and len(message) > self.max_message_length:
+            record.message = message[:self.max_message_length]
+            self._truncation.cut = True
+
+    def fitItems(self, items):
+        """
+        Return ``[(key, value)]`` of ``items`` fitted in ``max_line_bytes``
+        as the line encoder does, the size of an item is measured by encoding
+        its key and value alone.
+        """
+        encoder = self.getEncoder()
+        encode = encoder.encode
+        size_of = _size_of(encoder.ensure_ascii, self.encoding)
+        separator_size = size_of(encoder.item_separator)
+        key_separator_size = size_of(encoder.key_separator)
+        size = 2 + separator_size + size_of(
+            encode(_TRUNCATED_KEY)) + key_separator_size + size_of('true')
+        fitted = []
+        for k, v in items:
+            item_size = size_of(encode(k)) + key_separator_size + (
+                separator_size if fitted else 0)
+            remaining = self.max_line_bytes - size - item_size
+            encoded_size = None if _never_fits(v, remaining) else size_of(encode(v))
+            if encoded_size is None or encoded_size > remaining:
+                self._truncation.cut = True
+                if isinstance(v, basestring):
+                    fitted_value = _fit_string(encode, v, remaining, size_of)
+                elif remaining >= 4:
+                    fitted_value = (None, 'null')
+                else:
+                    fitted_value = None
+                if fitted_value is None:
+                    # even `null` is too long, the key is left out
+                    continue
+                v, encoded_size = fitted_value[0], size_of(fitted_value[1])
+            size += item_size + encoded_size
+            fitted.append((k, v))
+        return fitted
+
+    def setRecordMessage(self, record, profile=None):
         if isinstance(record.msg, (int, long, float, bool, type(None))):
             # keep these types without quote when output
             record.message = record.msg
@@ -322,6 +1264,10 @@ class JsonFormatter(logging.Formatter):
         if record.args:
             record.message = record.getMessage()
 
+        if self.structured_exc and (profile or self._profile).exc_attrs:
+            # output by `exc_*` and `stack_frames` attributes
+            return
+
         if record.exc_info:
             # Cache the traceback text to avoid converting it multiple times
             # (it's constant anyway)
@@ -341,54 +1287,303 @@ class JsonFormatter(logging.Formatter):
                 self.formatStack(record.stack_info)
         # compatible python2, record no stack_info attribute in python2, end
 
+    def formatException(self, ei):
+        """
+        Same as ``logging.Formatter.formatException``, but the traceback except
+        the exception messages is cached by the exception types and code
+        locations, the same failure logged again only formats its messages.
+        """
+        # compatible python2, python3.4 start
+        if sys.version_info < (3, 5) or ei[1] is None:
+            return logging.Formatter.formatException(self, ei)
+        # compatible python2, python3.4 end
+        if not self.exc_cache_size and self.exc_max_frames is None:
+            return logging.Formatter.formatException(self, ei)
+
+        chain = _exception_chain(ei[1], ei[2])
+        if _BaseExceptionGroup is not None and any(
+                isinstance(exc, _BaseExceptionGroup) for _, exc, _ in chain):
+            return logging.Formatter.formatException(self, ei)
+
+        limit = None if self.exc_max_frames is None else -self.exc_max_frames
+        key = (limit, tuple(
+            (message, type(exc), _traceback_locations(tb))
+            for message, exc, tb in chain
+        ))
+        stacks = self._exc_cache.get(key)
+        if stacks is None:
+            stacks = []
+            for message, exc, tb in chain:
+                stack = traceback.TracebackException(
+                    type(exc), exc, tb, limit=limit).stack
+                stacks.append((message or '') + (
+                    'Traceback (most recent call last):\n' + ''.join(stack.format())
+                    if stack else ''))
+            if self.exc_cache_size:
+                self._exc_cache.set(key, stacks)
+
+        s = ''.join(
+            stack + ''.join(self.formatExceptionOnly(exc))
+            for stack, (_, exc, _) in zip(stacks, chain)
+        )
+        if s[-1:] == "\n":
+            s = s[:-1]
+        return s
+
+    def formatExceptionOnly(self, exc):
+        """
+        Return the lines of ``traceback.format_exception_only``, the chained
+        exceptions' source lines aren't looked up.
+        """
+        return traceback.TracebackException(
+            type(exc), exc, None, lookup_lines=False).format_exception_only()
+
+    def setRecordExcAttrs(self, record, profile=None):
+        """
+        Set ``exc_type``, ``exc_message`` and ``exc_frames`` of
+        ``record.exc_info``, ``stack_frames`` of ``record.stack_info``, only
+        the ones used by ``fmt`` are computed, they are ``None`` if no
+        exception or stack is logged.
+        """
+        exc_info = record.exc_info
+        if not exc_info or exc_info[1] is None:
+            exc_info = None
+        for attr in (profile or self._profile).exc_attrs:
+            if attr == 'stack_frames':
+                # compatible python2, record no stack_info attribute in python2
+                value = self.getStackFrames(getattr(record, 'stack_info', None))
+            elif exc_info is None:
+                value = None
+            elif attr == 'exc_type':
+                value = _exception_type_name(exc_info[0])
+            elif attr == 'exc_message':
+                try:
+                    value = str(exc_info[1])
+                except Exception:
+                    value = '<exception str() failed>'
+            else:
+                value = self.getTracebackFrames(exc_info[2])
+            setattr(record, attr, value)
+
+    def makeFrame(self, filename, lineno, name, line=None):
+        frame = dictionary()
+        frame['filename'] = filename
+        frame['lineno'] = lineno
+        frame['name'] = name
+        if self.exc_source_lines:
+            frame['line'] = line
+        return frame
+
+    def limitFrames(self, frames):
+        if self.exc_max_frames is not None:
+            return frames[-self.exc_max_frames:] if self.exc_max_frames else []
+        return frames
+
+    def getTracebackFrames(self, tb):
+        """
+        Return the frames (``filename``, ``lineno``, ``name`` and ``line`` if
+        ``exc_source_lines``) of ``tb``, the most recent is the last, at most
+        ``exc_max_frames`` ones, the source lines are only read for them.
+        """
+        tbs = []
+        while tb is not None:
+            tbs.append(tb)
+            tb = tb.tb_next
+        frames = []
+        for tb in self.limitFrames(tbs):
+            code = tb.tb_frame.f_code
+            line = None
+            if self.exc_source_lines:
+                line = linecache.getline(
+                    code.co_filename, tb.tb_lineno, tb.tb_frame.f_globals).strip() or None
+            frames.append(self.makeFrame(code.co_filename, tb.tb_lineno, code.co_name, line))
+        return frames
+
+    def getStackFrames(self, stack_info):
+        """
+        Return the frames of ``stack_info`` like ``getTracebackFrames``, the
+        stack is already formatted when the record is made.
+        """
+        if not stack_info:
+            return None
+        return [
+            self.makeFrame(filename, int(lineno), name, line or None)
+            for filename, lineno, name, line in self.limitFrames(
+                _STACK_FRAME_RE.findall(stack_info))
+        ]
+
+    def formatTime(self, record, datefmt=None):
+        """
+        Same as ``logging.Formatter.formatTime``, but the formatted seconds is
+        cached, only the milliseconds is formatted for every record.
+        """
+        second = int(record.created)
+        key = ('asctime', datefmt, self.converter)
+        cached = self._time_cache.get(key)
+        if cached is None or cached[0] != second:
+            ct = self.converter(second)
+            cached = (second, time.strftime(
+                datefmt or getattr(self, 'default_time_format', '%Y-%m-%d %H:%M:%S'), ct))
+            self._time_cache[key] = cached
+        if datefmt:
+            return cached[1]
+        default_msec_format = getattr(self, 'default_msec_format', '%s,%03d')
+        if default_msec_format:
+            return default_msec_format % (cached[1], record.msecs)
+        return cached[1]
+
+    def formatIsoTime(self, record, utc=False, precision=3):
+        """
+        Return ISO-8601 time of ``record`` with ``precision`` (3 or 6) digits
+        of fraction second, the formatted seconds is cached.
+        """
+        second = int(record.created)
+        key = ('iso8601', utc, self.converter)
+        cached = self._time_cache.get(key)
+        if cached is None or cached[0] != second:
+            if utc:
+                ct = time.gmtime(second)
+                suffix = 'Z'
+            else:
+                ct = self.converter(second)
+                offset = (calendar.timegm(ct) - second) // 60
+                suffix = '%s%02d:%02d' % (
+                    '-' if offset < 0 else '+', abs(offset) // 60, abs(offset) % 60)
+            cached = (second, '%04d-%02d-%02dT%02d:%02d:%02d' % tuple(ct[:6]), suffix)
+            self._time_cache[key] = cached
+        if precision == 6:
+            fraction = '.%06d' % int((record.created - second) * 1000000)
+        else:
+            fraction = '.%03d' % record.msecs
+        return cached[1] + fraction + cached[2]
+
+    def setRecordTimes(self, record, profile=None):
+        for attr in (profile or self._profile).time_attrs:
+            if attr == 'asctime':
+                record.asctime = self.formatTime(record, self.datefmt)
+            elif attr == 'iso8601':
+                record.iso8601 = self.formatIsoTime(record)
+            elif attr == 'iso8601_utc':
+                record.iso8601_utc = self.formatIsoTime(record, utc=True)
+            elif attr == 'rfc3339':
+                record.rfc3339 = self.formatIsoTime(record, precision=6)
+            elif attr == 'epoch_ms':
+                record.epoch_ms = int(record.created) * 1000 + int(record.msecs)
+            elif attr == 'epoch_ns':
+                record.epoch_ns = int(record.created * 1000000000)
+
     def getRecordExtraAttrs(self, record):
+        set_attrs = record.__dict__.get(_SET_ATTRS_KEY, ())
         extras = {
             k: record.__dict__[k]
             for k in record.__dict__
-            if k not in _LogRecordDefaultAttributes
+            if k not in _LogRecordDefaultAttributes and k not in set_attrs and k != _SET_ATTRS_KEY
         }
         if sys.version_info >= (3, 7):
             return extras
         else:
             return dictionary((k, extras[k]) for k in sorted(extras.keys()))
 
-    def setRecordCustomAttrs(self, record):
-        for k, v in self.record_custom_attrs.items():
-            setattr(record, k, v(**record.__dict__))
+    def setRecordCustomAttrs(self, record, profile=None):
+        record_dict = record.__dict__
+        for k, func, params in (profile or self._profile).custom_attr_calls:
+            if params is None:
+                value = func(**record_dict)
+            elif params:
+                value = func(**{p: record_dict[p] for p in params if p in record_dict})
+            else:
+                value = func()
+            setattr(record, k, value)
 
-    def formatMessage(self, record):
-        return self._style.format(record)
+    def formatMessage(self, record, fmt=None):
+        return self._style.format(record, fmt)
 
-    def format(self, record):
-        def _set_extra_to_result():
-            for k, v in extra.items():
-                if k not in self.json_fmt:
-                    result[k] = v
-
-        def _set_fmt_to_result():
-            # this is for keeping `record` attribute `type`
-            if v in record.__dict__:
-                result[k] = getattr(record, v, None)
-            # this is for convert to string
+    def getFieldValues(self, record, extra=None, profile=None):
+        """
+        Return the values of the compiled ``fmt`` fields, in ``fmt`` order.
+        """
+        record_dict = record.__dict__
+        values = []
+        append = values.append
+        for k, kind, v in (profile or self._profile).fields:
+            if extra and k in extra:
+                append(extra[k])
+            elif kind == _FIELD_ATTR:
+                # this is for keeping `record` attribute `type`, a value
+                # isn't an attribute is output as it is
+                append(record_dict.get(v, v))
+            elif kind == _FIELD_CUSTOM:
+                append(record_dict[v])
+            elif kind == _FIELD_TEMPLATE:
+                # this is for convert to string
+                append(self.formatMessage(record, v))
             else:
-                self._style._fmt = v
-                result[k] = self.formatMessage(record)
-
-        result = dictionary()
+                append(v)
+        return values
 
-        self.setRecordMessage(record)
+    def format(self, record):
+        counters = None if self._stats is None else self._stats.counters()
+        return self._formatRecord(record, self.getProfile(record), self.isLimited(), counters)
 
-        record.asctime = self.formatTime(record, self.datefmt)
+    def _formatRecord(self, record, profile, limited, counters, encode_line=_MISSING):
+        """
+        Format ``record`` by ``profile``, the settings looked up for every
+        record by ``format`` are passed in, so ``formatMany`` looks them up
+        once for all the records.
+        """
+        result = dictionary()
+        mix_extra = self.mix_extra if profile.mix_extra is None else profile.mix_extra
+        mix_extra_position = profile.mix_extra_position or self.mix_extra_position
+        json_fmt = profile.json_fmt
+        if limited:
+            self._truncation.cut = False
+        tick = None
+        if counters is not None:
+            if not counters[_STATS_RECORDS] % _STATS_SAMPLE:
+                start = tick = _perf_counter_ns()
+
+        if profile.uses_message:
+            self.setRecordMessage(record, profile)
+            if self.max_message_length is not None:
+                self.truncateMessage(record)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_MESSAGE, tick)
 
         # pop stored __extra start
-        extra = record.__dict__.pop('__extra', None) or record.__dict__.pop('_JsonFormatter__extra', None)
-        if extra is None:
-            # extra is dictionary
-            extra = self.getRecordExtraAttrs(record)
+        # `extra` must be stored before custom attributes are set to
+        # `LogRecord`, for other formatters mix it
+        extra = None
+        if mix_extra or profile.custom_attr_calls:
+            extra = record.__dict__.pop('__extra', None) or record.__dict__.pop('_JsonFormatter__extra', None)
+            if extra is None:
+                # extra is dictionary
+                extra = self.getRecordExtraAttrs(record)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_EXTRA, tick)
         # pop stored __extra end
 
-        if self.record_custom_attrs:
-            self.setRecordCustomAttrs(record)
+        if profile.set_attrs:
+            # other formatters of the record don't take them as `extra`
+            set_attrs = record.__dict__.get(_SET_ATTRS_KEY)
+            if set_attrs is None:
+                record.__dict__[_SET_ATTRS_KEY] = profile.set_attrs
+            elif not profile.set_attrs <= set_attrs:
+                record.__dict__[_SET_ATTRS_KEY] = set_attrs | profile.set_attrs
+
+        if profile.time_attrs:
+            self.setRecordTimes(record, profile)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_TIME, tick)
+
+        if profile.exc_attrs:
+            self.setRecordExcAttrs(record, profile)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_EXCEPTION, tick)
+
+        if profile.custom_attr_calls:
+            self.setRecordCustomAttrs(record, profile)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_CUSTOM_ATTRS, tick)
 
         # compatible python2 start
         if sys.version_info < (3, 0):
@@ -397,45 +1592,226 @@ class JsonFormatter(logging.Formatter):
                     record.__dict__.update({k: v.decode(self.encoding)})
         # compatible python2 end
 
-        if not self.mix_extra:
-            for k, v in self.json_fmt.items():
-                _set_fmt_to_result()
+        line = None
+        if not mix_extra:
+            values = self.getFieldValues(record, profile=profile)
+            if self.max_value_length is not None:
+                values = self.truncateValues(profile.keys, values, profile.value_keys)
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_FIELDS, tick)
+            if encode_line is _MISSING:
+                encode_line = self.getLineEncoder(profile)
+            if encode_line is not None:
+                # no dict is needed, only the values are encoded
+                line = encode_line(values)
+            else:
+                result.update(zip(profile.keys, values))
         else:
-            if self.mix_extra_position == 'head':
-                _set_extra_to_result()
-            for k, v in self.json_fmt.items():
-                if k in extra:
-                    result[k] = extra[k]
-                else:
-                    _set_fmt_to_result()
-            if self.mix_extra_position == 'tail':
-                _set_extra_to_result()
-            if self.mix_extra_position == 'mix':
-                _set_extra_to_result()
+            if mix_extra_position == 'head':
+                for k, v in extra.items():
+                    if k not in json_fmt:
+                        result[k] = v
+            result.update(zip(profile.keys, self.getFieldValues(record, extra, profile)))
+            if mix_extra_position != 'head':
+                for k, v in extra.items():
+                    if k not in json_fmt:
+                        result[k] = v
+            if mix_extra_position == 'mix':
                 result = dictionary(
                     (k, result[k])
                     for k in sorted(result.keys())
                 )
-
-        self._style._fmt = ''
+            if self.max_value_length is not None:
+                # the keys overwritten by `extra` are limited too
+                result = dictionary(zip(result.keys(), self.truncateValues(
+                    result.keys(), result.values(), profile.value_keys.union(extra))))
+            if tick is not None:
+                tick = _count_phase(counters, _STATS_FIELDS, tick)
 
         # store __extra start
-        record.__extra = extra
+        if extra is not None:
+            record.__extra = extra
         # store __extra end
 
-        return json.dumps(
-            result,
-            skipkeys=self.skipkeys,
-            ensure_ascii=self.ensure_ascii,
-            check_circular=self.check_circular,
-            allow_nan=self.allow_nan,
-            cls=self.cls,
-            indent=self.indent,
-            separators=self.separators,
-            default=self.default,
-            sort_keys=self.sort_keys,
-            **self.kw
-        )
+        if line is None:
+            if limited:
+                if self.max_line_bytes is not None:
+                    result = dictionary(self.fitItems(result.items()))
+                if self._truncation.cut:
+                    result[_TRUNCATED_KEY] = True
+            encoder = self.getEncoder()
+            line = encoder.encode(result)
+            if limited and self._truncation.cut and result.get(_TRUNCATED_KEY) is not True:
+                # cut by `default` while it is encoded
+                result[_TRUNCATED_KEY] = True
+                line = encoder.encode(result)
+
+        if counters is not None:
+            counters[_STATS_RECORDS] += 1
+            if self.ensure_ascii or _is_ascii(line):
+                # other lines are counted by `encodeLine`
+                counters[_STATS_OUTPUT] += len(line)
+            if tick is not None:
+                counters[_STATS_TIMED] += 1
+                counters[_STATS_FORMAT] += _perf_counter_ns() - start
+        return line
+
+    def enableStats(self):
+        """
+        Count the phases of ``format`` from now on, same as ``collect_stats``.
+        """
+        if self._stats is None:
+            self._stats = _FormatStats()
+
+    def stats(self, reset=False):
+        """
+        Return the snapshot of ``collect_stats`` counters, ``None`` if it is
+        not enabled, the counters are set to zero if ``reset`` is ``True``.
+
+        ``records`` and ``output_bytes`` are the formatted records and bytes,
+        if ``ensure_ascii`` is false, lines with non-ASCII characters are
+        counted only when they are encoded by ``formatBytes``, ``format``
+        never encodes the line for it. ``phases`` maps every phase to its
+        ``count`` and ``ns``, ``format`` is all of ``format``, ``encode`` is
+        the rest of ``format`` except the other phases, mainly building and
+        encoding the JSON object. The phases of one of every 16 records of a
+        thread are timed, their ``count`` and ``ns`` are scaled to all the
+        records.
+        """
+        if self._stats is None:
+            return None
+        total = self._stats.snapshot(reset)
+        records = total[_STATS_RECORDS]
+        timed = total[_STATS_TIMED]
+
+        def _scale(value):
+            return value * records // timed if timed else 0
+
+        phases = dictionary()
+        phases['format'] = {'count': records, 'ns': _scale(total[_STATS_FORMAT])}
+        for i, phase in enumerate(_STATS_PHASES):
+            index = _STATS_MESSAGE + 2 * i
+            phases[phase] = {'count': _scale(total[index]), 'ns': _scale(total[index + 1])}
+        phases['encode'] = {
+            'count': records,
+            'ns': max(0, phases['format']['ns'] - sum(
+                phases[p]['ns'] for p in _STATS_PHASES))
+        }
+        return {
+            'records': total[_STATS_RECORDS],
+            'output_bytes': total[_STATS_OUTPUT],
+            'phases': phases
+        }
+
+    def formatBytes(self, record):
+        """
+        Format ``record`` to ``encoding`` (default UTF-8) encoded bytes, for
+        handlers write to binary streams.
+        """
+        return self.encodeLine(self.format(record))
+
+    def encodeLine(self, line):
+        """
+        Return ``line`` encoded by ``encoding``, the bytes of a non-ASCII
+        line are counted here for ``collect_stats``.
+        """
+        data = line.encode(self.encoding, 'backslashreplace')
+        if self._stats is not None and not (self.ensure_ascii or _is_ascii(line)):
+            self._stats.counters()[_STATS_OUTPUT] += len(data)
+        return data
+
+    def _iterFormat(self, records):
+        """
+        Yield the lines of ``records`` formatted same as ``format``, the
+        settings ``format`` looks up for every record are looked up once.
+        """
+        if type(self).format != JsonFormatter.format:
+            # the output of a subclass is from its `format`
+            for record in records:
+                yield self.format(record)
+            return
+        format_record = self._formatRecord
+        limited = self.isLimited()
+        counters = None if self._stats is None else self._stats.counters()
+        profile = None if self._level_profiles else self._profile
+        get_profile = self.getProfile
+        line_encoders = {}
+        for record in records:
+            record_profile = profile or get_profile(record)
+            encode_line = line_encoders.get(record_profile, _MISSING)
+            if encode_line is _MISSING:
+                encode_line = line_encoders[record_profile] = self.getLineEncoder(record_profile)
+            yield format_record(record, record_profile, limited, counters, encode_line)
+
+    def formatMany(self, records, as_bytes=False):
+        """
+        Format ``records`` to one NDJSON buffer, every line is terminated by
+        ``\\n``. It is ``str``, or ``encoding`` encoded bytes if ``as_bytes``
+        is true. The profiles of levels, line encoders, size limits and
+        ``collect_stats`` counters are looked up once for all the records, the
+        encoder, compiled ``fmt`` and cached time are shared by them.
+        """
+        lines = list(self._iterFormat(records))
+        if as_bytes:
+            lines = list(map(self.encodeLine, lines))
+            newline = b'\n'
+        else:
+            newline = '\n'
+        if lines:
+            lines.append(newline[:0])
+        return newline.join(lines)
+
+    def iterFormatMany(self, records, chunk_size=65536, as_bytes=False):
+        """
+        Same as ``formatMany``, but yield the NDJSON in chunks of about
+        ``chunk_size`` characters (bytes if ``as_bytes`` is true), a line is
+        never split into two chunks.
+        """
+        empty = b'' if as_bytes else ''
+        lines = []
+        size = 0
+        for line in self._iterFormat(records):
+            line = self.encodeLine(line) + b'\n' if as_bytes else line + '\n'
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield empty.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield empty.join(lines)
+
+
+class JsonLogger(logging.Logger):
+    """
+    A logger records the keys of ``extra`` when the ``LogRecord`` is made, so
+    ``JsonFormatter`` mixes ``extra`` by these keys directly instead of
+    scanning all the attributes of ``LogRecord``. Attributes set to the
+    record later (e.g. by filters or ``record_custom_attrs``) aren't
+    ``extra``.
+
+    It is opt-in, by ``logging.setLoggerClass(JsonLogger)`` before the
+    loggers are created. ``logging.root`` is always ``logging.RootLogger``,
+    records logged by it are still scanned.
+    """
+
+    def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None, sinfo=None):
+        # compatible python2, `Logger.makeRecord` has no `sinfo` parameter start
+        if sys.version_info < (3, 0):
+            rv = logging.Logger.makeRecord(
+                self, name, level, fn, lno, msg, args, exc_info, func, extra)
+        else:
+            rv = logging.Logger.makeRecord(
+                self, name, level, fn, lno, msg, args, exc_info, func, extra, sinfo)
+        # compatible python2, `Logger.makeRecord` has no `sinfo` parameter end
+
+        # the same as `JsonFormatter` stores `__extra`
+        keys = list(extra or ())
+        if sys.version_info < (3, 7):
+            keys.sort()
+        rv.__dict__['_JsonFormatter__extra'] = dictionary(
+            (k, rv.__dict__[k]) for k in keys)
+        return rv
 
 
 def _acquireLock():
@@ -500,6 +1876,9 @@ def basicConfig(**kwargs):
               created FileHandler, causing it to be used when the file is
               opened in text mode. If not specified, the default value is
               `backslashreplace`.
+    buffer_size  If ``filemode`` is binary (e.g. 'ab'), a ``JsonFileHandler``
+              is created, it writes bytes of ``JsonFormatter.formatBytes``
+              through a buffer of this size, default is 64KB.
 
     Note that you could specify a stream created using open(filename, mode)
     rather than passing the filename and mode in. However, it should be
@@ -530,6 +1909,7 @@ def basicConfig(**kwargs):
         force = kwargs.pop('force', False)
         encoding = kwargs.pop('encoding', None)
         errors = kwargs.pop('errors', 'backslashreplace')
+        buffer_size = kwargs.pop('buffer_size', None)
         if force:
             for h in logging.root.handlers[:]:
                 logging.root.removeHandler(h)
@@ -547,9 +1927,13 @@ def basicConfig(**kwargs):
             if handlers is None:
                 filename = kwargs.pop("filename", None)
                 mode = kwargs.pop("filemode", 'a')
-                if filename:
-                    if 'b'in mode:
-                        errors = None
+                if buffer_size is not None and not (filename and 'b' in mode):
+                    raise ValueError("'buffer_size' should be specified together "
+                                     "with 'filename' and binary 'filemode'")
+                if filename and 'b' in mode:
+                    from .handlers import JsonFileHandler
+                    h = JsonFileHandler(filename, mode, buffer_size=buffer_size)
+                elif filename:
                     if sys.version_info >= (3, 9):
                         h = logging.FileHandler(filename, mode,
                                         encoding=encoding, errors=errors)
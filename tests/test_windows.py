@@ -9,14 +9,45 @@ Github: https://github.com/yourname
 Description: jsonformatter.py
 """
 import datetime
+import json
 import logging
 import os
 import random
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from collections import OrderedDict
+from io import BytesIO
 from logging.config import fileConfig
 
-from jsonformatter import JsonFormatter, basicConfig
+# compatible python2 start
+try:
+    # `str` and `unicode` can be written to it in python2
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+# compatible python2 end
+
+from jsonformatter import (CachedCustomAttr, JsonBatchFileHandler,
+                           JsonFileHandler, JsonFormatter, JsonLogger,
+                           JsonLogstashHandler, JsonQueueHandler,
+                           JsonRotatingFileHandler, SamplingFilter,
+                           basicConfig)
+from jsonformatter.jsonformatter import BASIC_FORMAT
 
 
 class JsonFormatterTest(unittest.TestCase):
@@ -492,6 +523,1298 @@ class JsonFormatterTest(unittest.TestCase):
         )
         logging.info('basic config format')
 
+    def test_compiled_fmt_field_kinds(self):
+        FIELD_KINDS_FORMAT = OrderedDict([
+            ("level", "levelname"),  # attribute
+            ("user", "user"),  # custom attribute
+            ("log", "%(levelname)s: %(message)s"),  # template
+            ("service", "demo"),  # not an attribute
+            ("version", 1)  # constant
+        ])
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+
+        stream = StringIO()
+        sh = logging.StreamHandler(stream)
+        formatter = JsonFormatter(
+            FIELD_KINDS_FORMAT, record_custom_attrs={'user': lambda: 'admin'})
+        sh.setFormatter(formatter)
+        sh.setLevel(logging.INFO)
+
+        root.addHandler(sh)
+        root.info('test %s', 'compiled fmt')
+        root.info('test extra', extra={'demo': 'extra demo'})
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0]), {
+            "level": "INFO",
+            "user": "admin",
+            "log": "INFO: test compiled fmt",
+            "service": "demo",
+            "version": 1
+        })
+        self.assertEqual(json.loads(lines[1])['service'], 'extra demo')
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'the output is `unicode` but the literal is `str` in python 2')
+    def test_cached_json_encoder(self):
+        formatter = JsonFormatter(ensure_ascii=False, separators=(',', ':'))
+        encoder = formatter.getEncoder()
+        self.assertIs(encoder, formatter.getEncoder())
+
+        record = logging.makeLogRecord({'msg': 'test cached json encoder: '})
+        self.assertEqual(
+            formatter.format(record),
+            '{"levelname":"Level None","name":null,"message":"test cached json encoder: "}'
+        )
+
+        formatter.ensure_ascii = True
+        self.assertIsNot(encoder, formatter.getEncoder())
+        self.assertEqual(
+            formatter.format(record),
+            '{"levelname":"Level None","name":null,"message":"test cached json encoder: \\u4e2d"}'
+        )
+
+    def test_prepare_only_used_attrs(self):
+        formatter = JsonFormatter(
+            OrderedDict([("level", "levelname"), ("msg", "msg")]),
+            record_custom_attrs={'user': lambda: 'admin'}
+        )
+        try:
+            1 / 0
+        except Exception:
+            record = logging.makeLogRecord({
+                'msg': 'test prepare only used attrs',
+                'levelname': 'ERROR',
+                'exc_info': sys.exc_info()
+            })
+        self.assertEqual(
+            formatter.format(record),
+            '{"level": "ERROR", "msg": "test prepare only used attrs"}'
+        )
+        for attr in ('message', 'asctime', 'user'):
+            self.assertFalse(hasattr(record, attr))
+        self.assertIsNone(record.exc_text)
+
+        formatter = JsonFormatter(
+            """{"log": "%(asctime)s %(message)s", "user": "user"}""",
+            record_custom_attrs={'user': lambda: 'admin'}
+        )
+        self.assertEqual(json.loads(formatter.format(record))['user'], 'admin')
+        self.assertTrue(record.asctime)
+        self.assertTrue(record.exc_text)
+
+    def test_time_attributes(self):
+        TIME_FORMAT = OrderedDict([
+            ("asctime", "asctime"),
+            ("iso8601", "iso8601"),
+            ("iso8601_utc", "iso8601_utc"),
+            ("rfc3339", "rfc3339"),
+            ("epoch_ms", "epoch_ms"),
+            ("epoch_ns", "epoch_ns"),
+            ("log", "%(iso8601_utc)s %(message)s")
+        ])
+        formatter = JsonFormatter(TIME_FORMAT)
+        formatter.converter = time.gmtime
+        record = logging.makeLogRecord({'msg': 'test time attributes'})
+        record.created = 1057654185.896123
+        record.msecs = 896.123
+
+        self.assertEqual(json.loads(formatter.format(record)), {
+            "asctime": logging.Formatter.formatTime(formatter, record),
+            "iso8601": "2003-07-08T08:49:45.896+00:00",
+            "iso8601_utc": "2003-07-08T08:49:45.896Z",
+            "rfc3339": "2003-07-08T08:49:45.896123+00:00",
+            "epoch_ms": 1057654185896,
+            "epoch_ns": int(record.created * 1000000000),
+            "log": "2003-07-08T08:49:45.896Z test time attributes"
+        })
+
+        # the formatted seconds is cached, only the fraction changes
+        record.created += 0.1
+        record.msecs = 996.123
+        self.assertEqual(
+            formatter.formatTime(record, '%Y-%m-%d %H:%M:%S'), '2003-07-08 08:49:45')
+        self.assertEqual(
+            formatter.formatTime(record), logging.Formatter.formatTime(formatter, record))
+        self.assertEqual(
+            formatter.formatIsoTime(record, utc=True), '2003-07-08T08:49:45.996Z')
+
+        formatter.converter = time.localtime
+        self.assertEqual(
+            formatter.formatIsoTime(record)[:-6].replace('T', ' '),
+            logging.Formatter.formatTime(formatter, record).replace(',', '.')
+        )
+
+    def test_extra_same_name_as_formatter_attributes(self):
+        formatter = JsonFormatter(
+            OrderedDict([("message", "message")]), mix_extra=True)
+        record = logging.makeLogRecord(
+            {'msg': 'test extra', 'exc_type': 'Timeout', 'epoch_ms': 5})
+        result = json.loads(formatter.format(record))
+        # `LogRecord` has `taskName` attribute from python 3.12
+        result.pop('taskName', None)
+        self.assertEqual(
+            result, {"message": "test extra", "exc_type": "Timeout", "epoch_ms": 5})
+
+        # the attributes set by another formatter aren't extra
+        record = logging.makeLogRecord({'msg': 'test extra'})
+        JsonFormatter(OrderedDict([("epoch_ms", "epoch_ms")])).format(record)
+        result = json.loads(formatter.format(record))
+        result.pop('taskName', None)
+        self.assertEqual(result, {"message": "test extra"})
+
+    def test_line_encoder_same_as_json_dumps(self):
+        class Custom(object):
+            def __repr__(self):
+                return 'custom'
+
+        LINE_FORMAT = OrderedDict([
+            ("str", "str"),
+            ("unicode", "unicode"),
+            ("int", "int"),
+            ("bool", "bool"),
+            ("none", "none"),
+            ("float", "float"),
+            ("nan", "nan"),
+            ("big", "big"),
+            ("list", "list"),
+            ("dict", "dict"),
+            ("custom", "custom"),
+            ("message", "%(message)s")
+        ])
+        record = logging.makeLogRecord({
+            'msg': 'test "line" encoder\n',
+            'str': 'str',
+            'unicode': u'',
+            'int': 10 ** 20,
+            'bool': True,
+            'none': None,
+            'float': 0.1,
+            'nan': float('nan'),
+            'big': float('inf'),
+            'list': [1, 'a', None],
+            'dict': {'a': [1.5, False]},
+            'custom': Custom()
+        })
+        for kwargs in [
+            {'default': repr},
+            {'default': repr, 'ensure_ascii': False},
+            {'default': repr, 'separators': (',', ':')},
+            {'default': repr, 'sort_keys': True},
+            {'default': repr, 'indent': 2},
+        ]:
+            formatter = JsonFormatter(LINE_FORMAT, **kwargs)
+            # python2 always encodes the dict
+            self.assertEqual(
+                formatter.getLineEncoder() is None,
+                'sort_keys' in kwargs or 'indent' in kwargs or sys.version_info < (3, 0)
+            )
+            expected = OrderedDict(
+                (k, record.__dict__[v]) for k, v in LINE_FORMAT.items()
+                if k != 'message'
+            )
+            expected['message'] = record.msg
+            self.assertEqual(
+                formatter.format(record), json.dumps(expected, **kwargs))
+
+    def test_thread_safe_format(self):
+        THREAD_SAFE_FORMAT = OrderedDict([
+            ("message", "message: %(message)s"),
+            ("thread", "thread: %(threadName)s"),
+            ("lineno", "lineno: %(lineno)d")
+        ])
+        formatter = JsonFormatter(THREAD_SAFE_FORMAT)
+        errors = []
+
+        def _format(n):
+            thread_name = threading.current_thread().name
+            for i in range(2000):
+                record = logging.makeLogRecord({
+                    'msg': '%s-%s' % (n, i),
+                    'threadName': thread_name,
+                    'lineno': i
+                })
+                result = json.loads(formatter.format(record))
+                if result != {
+                    "message": "message: %s-%s" % (n, i),
+                    "thread": "thread: %s" % thread_name,
+                    "lineno": "lineno: %s" % i
+                }:
+                    errors.append(result)
+
+        threads = [threading.Thread(target=_format, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_format_bytes(self):
+        formatter = JsonFormatter(
+            """{"log": "message"}""", ensure_ascii=False)
+        # compatible python2, `str()` of a non-ASCII `unicode` msg fails
+        record = logging.makeLogRecord({'msg': 'test format bytes: %s', 'args': (u'', )})
+        self.assertEqual(
+            formatter.formatBytes(record),
+            u'{"log": "test format bytes: "}'.encode('utf-8')
+        )
+
+    def test_basic_config_binary_file(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'jsonformatter.log')
+        basicConfig(
+            level=logging.INFO,
+            filename=filename,
+            filemode='ab',
+            buffer_size=1024 * 1024,
+            force=True,
+            format="""{"levelname": "levelname", "log": "message"}"""
+        )
+        handler = logging.getLogger().handlers[0]
+        self.assertIsInstance(handler, JsonFileHandler)
+        for i in range(3):
+            logging.info('basic config binary file %s', i)
+        handler.close()
+
+        with open(filename, 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(
+            [json.loads(line.decode('utf-8')) for line in lines],
+            [{"levelname": "INFO", "log": "basic config binary file %s" % i} for i in range(3)]
+        )
+        self.assertRaises(
+            ValueError, basicConfig, filename=filename, buffer_size=1024, force=True)
+
+    def test_json_queue_handler(self):
+        stream = StringIO()
+        sh = logging.StreamHandler(stream)
+        sh.setFormatter(JsonFormatter(
+            """{"thread": "threadName", "log": "message"}""", mix_extra=True))
+        qh = JsonQueueHandler([sh], maxsize=100)
+        self.assertRaises(ValueError, JsonQueueHandler, [sh], policy='unknown')
+
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(qh)
+        args = ['args']
+        root.warning('test json queue handler %s', args, extra={'n': 0})
+        # the merged message is snapshot on caller thread
+        args.append('changed')
+        for i in range(1, 50):
+            root.warning('test json queue handler', extra={'n': i})
+        qh.close()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line['n'] for line in lines], list(range(50)))
+        self.assertEqual(lines[0]['log'], "test json queue handler ['args']")
+        self.assertEqual(lines[0]['thread'], threading.current_thread().name)
+        self.assertEqual(qh.dropped, 0)
+
+    def test_json_queue_handler_drop_policy(self):
+        stream = StringIO()
+        sh = logging.StreamHandler(stream)
+        qh = JsonQueueHandler([sh], maxsize=10, policy='drop')
+        # stop consuming, so the queue will be full
+        qh.listener.stop()
+        record = logging.makeLogRecord({'msg': 'test drop policy'})
+        for i in range(15):
+            qh.handle(record)
+        self.assertEqual(qh.dropped, 5)
+
+        # queued records are flushed when closed
+        qh.listener.start()
+        qh.close()
+        self.assertEqual(len(stream.getvalue().splitlines()), 10)
+
+    def test_format_many(self):
+        formatter = JsonFormatter("""{"log": "message"}""", ensure_ascii=False)
+        records = [
+            logging.makeLogRecord({'msg': 'test format many: %s %s', 'args': (i, u'')})
+            for i in range(100)
+        ]
+        expected = ''.join(formatter.format(r) + '\n' for r in records)
+
+        self.assertEqual(formatter.formatMany([]), '')
+        self.assertEqual(formatter.formatMany(records), expected)
+        self.assertEqual(
+            formatter.formatMany(iter(records), as_bytes=True),
+            expected.encode('utf-8')
+        )
+
+        chunks = list(formatter.iterFormatMany(records, chunk_size=256))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), expected)
+        for chunk in chunks:
+            self.assertEqual(chunk[-1], '\n')
+        chunks = list(formatter.iterFormatMany(records, chunk_size=256, as_bytes=True))
+        self.assertEqual(b''.join(chunks), expected.encode('utf-8'))
+
+        # the settings of every level are looked up once
+        formatter = JsonFormatter(
+            """{"log": "message"}""",
+            level_fmts={logging.ERROR: ("""{"error": "message"}""", {'mix_extra': True})})
+        records = [
+            logging.makeLogRecord({'msg': 'level %s' % i, 'levelno': level})
+            for i, level in enumerate([logging.INFO, logging.ERROR] * 3)
+        ]
+        self.assertEqual(formatter.formatMany(records), ''.join(formatter.format(r) + '\n' for r in records))
+
+        # `format` of a subclass is still called
+        class _Formatter(JsonFormatter):
+            def format(self, record):
+                return 'prefix ' + JsonFormatter.format(self, record)
+
+        self.assertEqual(
+            _Formatter("""{"log": "message"}""").formatMany(records[:1]), 'prefix {"log": "level 0"}\n')
+
+    def test_json_logger_capture_extra(self):
+        class _AddAttrFilter(logging.Filter):
+            def filter(self, record):
+                record.filter_attr = 'filter attr'
+                return True
+
+        stream = StringIO()
+        sh = logging.StreamHandler(stream)
+        sh.addFilter(_AddAttrFilter())
+        sh.setFormatter(JsonFormatter(
+            """{"log": "message", "user": "user"}""",
+            record_custom_attrs={'user': lambda: 'admin'},
+            mix_extra=True
+        ))
+        logger = JsonLogger('test_json_logger_capture_extra')
+        logger.addHandler(sh)
+        formatter = JsonFormatter(mix_extra=True)
+        formatter.getRecordExtraAttrs = None  # mustn't scan the record
+
+        logger.info('test json logger', extra={'b': 2, 'a': 1})
+        logger.info('test json logger without extra')
+        self.assertEqual(
+            [json.loads(line) for line in stream.getvalue().splitlines()],
+            [
+                {"log": "test json logger", "user": "admin", "b": 2, "a": 1},
+                {"log": "test json logger without extra", "user": "admin"}
+            ]
+        )
+
+        record = logger.makeRecord(
+            logger.name, logging.INFO, __file__, 1, 'test json logger', None, None, extra={'a': 1})
+        self.assertEqual(
+            json.loads(formatter.format(record)),
+            {"levelname": "INFO", "name": logger.name, "message": "test json logger", "a": 1}
+        )
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'keyword only parameters need python 3')
+    def test_record_custom_attrs_with_keyword_only_params(self):
+        calls = []
+
+        # keyword only parameters are syntax error in python2
+        namespace = {'calls': calls}
+        exec(
+            "def _status(*, levelname, missing='default'):\n"
+            "    calls.append(('status', levelname, missing))\n"
+            "    return 'failed' if levelname == 'ERROR' else 'success'\n",
+            namespace
+        )
+        _status = namespace['_status']
+
+        def _no_params():
+            calls.append(('no params',))
+            return 'no params'
+
+        def _all_attrs(**record_attrs):
+            calls.append(('all attrs', sorted(record_attrs) == sorted(record.__dict__)))
+            return record_attrs['levelno']
+
+        formatter = JsonFormatter(
+            OrderedDict([
+                ("status", "status"),
+                ("no params", "no params"),
+                ("levelno", "all attrs")
+            ]),
+            record_custom_attrs=OrderedDict([
+                ('status', _status),
+                ('no params', _no_params),
+                ('all attrs', _all_attrs)
+            ])
+        )
+        self.assertEqual(
+            [params for _, _, params in formatter.checkRecordCustomAttrs(formatter.record_custom_attrs)],
+            [('levelname', 'missing'), (), None]
+        )
+        record = logging.makeLogRecord({'msg': 'test keyword only params', 'levelname': 'ERROR', 'levelno': 40})
+        self.assertEqual(
+            json.loads(formatter.format(record)),
+            {"status": "failed", "no params": "no params", "levelno": 40}
+        )
+        self.assertEqual(
+            calls, [('status', 'ERROR', 'default'), ('no params',), ('all attrs', True)])
+
+    def test_cached_custom_attr(self):
+        calls = []
+
+        def _counter():
+            calls.append(1)
+            return len(calls)
+
+        # process constant
+        constant = CachedCustomAttr(_counter)
+        formatter = JsonFormatter(
+            """{"constant": "constant"}""", record_custom_attrs={'constant': constant})
+        record = logging.makeLogRecord({'msg': 'test cached custom attr'})
+        for _ in range(3):
+            self.assertEqual(formatter.format(record), '{"constant": 1}')
+        constant.clear()
+        self.assertEqual(formatter.format(record), '{"constant": 2}')
+
+        # ttl
+        del calls[:]
+        ttl = CachedCustomAttr(_counter, ttl=0.05)
+        self.assertEqual([ttl(), ttl()], [1, 1])
+        time.sleep(0.1)
+        self.assertEqual(ttl(), 2)
+
+        # keyed, least recently used one is evicted
+        del calls[:]
+        request_id = [None]
+        keyed = CachedCustomAttr(_counter, key=lambda: request_id[0], maxsize=2)
+        values = []
+        for rid in ['a', 'b', 'a', 'c', 'a', 'b']:
+            request_id[0] = rid
+            values.append(keyed())
+        self.assertEqual(values, [1, 2, 1, 3, 1, 4])
+
+        self.assertRaises(TypeError, CachedCustomAttr, None)
+        self.assertRaises(TypeError, CachedCustomAttr, _counter, key='key')
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'contextvars need python 3.7')
+    def test_cached_custom_attr_context_var(self):
+        import contextvars
+        request_id = contextvars.ContextVar('request_id')
+        keyed = CachedCustomAttr(lambda: 'user of %s' % request_id.get(), key=request_id)
+
+        request_id.set('1')
+        self.assertEqual(keyed(), 'user of 1')
+        ctx = contextvars.copy_context()
+        ctx.run(request_id.set, '2')
+        self.assertEqual(ctx.run(keyed), 'user of 2')
+        self.assertEqual(keyed(), 'user of 1')
+
+    def test_skip_unreachable_custom_attrs(self):
+        calls = []
+
+        def _attr(name):
+            def _func(**record_attrs):
+                calls.append(name)
+                return name
+            return _func
+
+        def _no_params(name):
+            def _func():
+                calls.append(name)
+                return name
+            return _func
+
+        RECORD_CUSTOM_ATTRS = OrderedDict([
+            ('expensive', _no_params('expensive')),
+            ('user', _no_params('user')),
+            ('tenant', _no_params('tenant')),
+            ('status', _attr('status'))
+        ])
+        # compatible python2, no `assertLogs`
+        messages = []
+        capture = logging.Handler(logging.DEBUG)
+        capture.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('jsonformatter.jsonformatter')
+        # `test_file_config` disables existing loggers
+        logger.disabled = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(capture)
+        try:
+            formatter = JsonFormatter(
+                """{"log": "{user} {message}"}""", style='{',
+                record_custom_attrs=RECORD_CUSTOM_ATTRS)
+        finally:
+            logger.removeHandler(capture)
+            logger.setLevel(logging.NOTSET)
+        self.assertEqual(formatter.skipped_custom_attrs, ['expensive', 'tenant', 'status'])
+        self.assertIn("['expensive', 'tenant', 'status']", messages[0])
+
+        record = logging.makeLogRecord({'msg': 'test skip custom attrs'})
+        self.assertEqual(formatter.format(record), '{"log": "user test skip custom attrs"}')
+        self.assertEqual(calls, ['user'])
+
+        # `**kwargs` one may read any custom attribute set before it
+        del calls[:]
+        formatter = JsonFormatter(
+            """{"status": "status"}""", record_custom_attrs=RECORD_CUSTOM_ATTRS)
+        self.assertEqual(formatter.skipped_custom_attrs, [])
+        formatter.format(record)
+        self.assertEqual(calls, ['expensive', 'user', 'tenant', 'status'])
+
+    def test_level_fmts(self):
+        calls = []
+
+        def _user():
+            calls.append('user')
+            return 'admin'
+
+        ERROR_FORMAT = OrderedDict([
+            ("level", "levelname"),
+            ("log", "message"),
+            ("user", "user"),
+            ("lineno", "lineno"),
+            ("where", "%(pathname)s:%(funcName)s")
+        ])
+        formatter = JsonFormatter(
+            """{"level": "levelname", "log": "message"}""",
+            record_custom_attrs={'user': _user},
+            level_fmts={
+                'ERROR': (ERROR_FORMAT, {'mix_extra': True}),
+                (logging.DEBUG, logging.DEBUG): """{"debug": "message"}""",
+                logging.CRITICAL: """{"critical": "message"}"""
+            }
+        )
+        self.assertEqual(formatter.skipped_custom_attrs, ['user'])
+
+        def _record(level):
+            return logging.makeLogRecord({
+                'msg': 'test level fmts', 'levelno': level,
+                'levelname': logging.getLevelName(level), 'lineno': 1,
+                'pathname': 'test.py', 'funcName': 'test_level_fmts',
+                'extra': 'extra'
+            })
+
+        self.assertEqual(
+            formatter.format(_record(logging.INFO)),
+            '{"level": "INFO", "log": "test level fmts"}')
+        self.assertEqual(calls, [])
+        self.assertEqual(
+            formatter.format(_record(logging.DEBUG)), '{"debug": "test level fmts"}')
+        self.assertEqual(
+            formatter.format(_record(logging.WARNING + 5)),
+            '{"level": "Level 35", "log": "test level fmts"}')
+        result = json.loads(formatter.format(_record(logging.ERROR)))
+        # `LogRecord` has `taskName` attribute from python 3.12
+        result.pop('taskName', None)
+        self.assertEqual(result, {
+            "level": "ERROR", "log": "test level fmts", "user": "admin",
+            "lineno": 1, "where": "test.py:test_level_fmts", "extra": "extra"
+        })
+        self.assertEqual(calls, ['user'])
+        self.assertEqual(
+            formatter.format(_record(logging.CRITICAL)), '{"critical": "test level fmts"}')
+
+        self.assertRaises(
+            ValueError, JsonFormatter, level_fmts={'UNKNOWN': BASIC_FORMAT})
+        self.assertRaises(
+            ValueError, JsonFormatter, level_fmts={'ERROR': (BASIC_FORMAT, {'indent': 4})})
+
+    @unittest.skipIf(sys.version_info < (3, 5), "`traceback.TracebackException` is added in python3.5")
+    def test_exception_cache(self):
+        def _exc_info(value, chained=True):
+            try:
+                try:
+                    int(value)
+                except ValueError as e:
+                    if chained:
+                        raise KeyError(value)
+                    raise
+            except Exception:
+                return sys.exc_info()
+
+        formatter = JsonFormatter(exc_cache_size=2)
+        stdlib = logging.Formatter()
+        for value in ('a', 'b'):
+            for chained in (True, False):
+                ei = _exc_info(value, chained)
+                self.assertEqual(formatter.formatException(ei), stdlib.formatException(ei))
+        self.assertEqual(len(formatter._exc_cache), 2)
+
+        # the tracebacks raised by the same code share one cache item
+        formatter = JsonFormatter()
+        for value in ('a', 'b', 'c'):
+            ei = _exc_info(value)
+            self.assertEqual(formatter.formatException(ei), stdlib.formatException(ei))
+        self.assertEqual(len(formatter._exc_cache), 1)
+
+        # only the most recent frames are output
+        formatter = JsonFormatter(exc_max_frames=1)
+        ei = _exc_info('a', False)
+        result = formatter.formatException(ei)
+        self.assertIn('int(value)', result)
+        self.assertNotIn('return sys.exc_info()', result)
+
+    @unittest.skipIf(sys.version_info < (3, 5), "`traceback.TracebackException` is added in python3.5")
+    def test_exception_attributes(self):
+        formatter = JsonFormatter(
+            """{"message": "message", "type": "exc_type", "error": "exc_message", "frames": "exc_frames"}""",
+            exc_max_frames=1
+        )
+        record = logging.makeLogRecord({'msg': 'no exception'})
+        self.assertEqual(
+            json.loads(formatter.format(record)),
+            {"message": "no exception", "type": None, "error": None, "frames": None})
+
+        try:
+            {}['missing']
+        except KeyError:
+            record = logging.makeLogRecord({'msg': 'failed', 'exc_info': sys.exc_info()})
+        result = json.loads(formatter.format(record))
+        self.assertEqual(result['type'], 'KeyError')
+        self.assertEqual(result['error'], "'missing'")
+        self.assertEqual(len(result['frames']), 1)
+        self.assertEqual(result['frames'][0]['name'], 'test_exception_attributes')
+        self.assertEqual(result['frames'][0]['filename'], __file__)
+        self.assertTrue(result['message'].startswith('failed\nTraceback (most recent call last):\n'))
+
+    @unittest.skipIf(sys.version_info < (3, 5), "`traceback.TracebackException` is added in python3.5")
+    def test_structured_exc(self):
+        formatter = JsonFormatter(
+            """{"message": "message", "type": "exc_type", "frames": "exc_frames", "stack": "stack_frames"}""",
+            structured_exc=True, exc_source_lines=True, exc_max_frames=2
+        )
+        try:
+            {}['missing']
+        except KeyError:
+            exc_info = sys.exc_info()
+        record = logging.makeLogRecord({
+            'msg': 'failed', 'exc_info': exc_info,
+            'stack_info': 'Stack (most recent call last):\n'
+                          '  File "a.py", line 1, in <module>\n'
+                          '    main()\n'
+                          '  File "b.py", line 2, in main\n'
+                          '    do()\n'
+                          '  File "<stdin>", line 3, in do'
+        })
+        result = json.loads(formatter.format(record))
+        self.assertEqual(result['message'], 'failed')
+        self.assertEqual(record.exc_text, None)
+        self.assertEqual(result['type'], 'KeyError')
+        self.assertEqual(result['frames'], [{
+            'filename': __file__, 'lineno': result['frames'][0]['lineno'],
+            'name': 'test_structured_exc', 'line': "{}['missing']"
+        }])
+        self.assertEqual(result['stack'], [
+            {'filename': 'b.py', 'lineno': 2, 'name': 'main', 'line': 'do()'},
+            {'filename': '<stdin>', 'lineno': 3, 'name': 'do', 'line': None}
+        ])
+
+        # the real `stack_info` logged by `logging`
+        formatter = JsonFormatter(
+            """{"message": "message", "stack": "stack_frames"}""", structured_exc=True)
+        record = logging.getLogger().makeRecord(
+            'test', logging.INFO, __file__, 1, 'stack', None, None, sinfo=None)
+        self.assertEqual(json.loads(formatter.format(record))['stack'], None)
+        logger = logging.getLogger()
+        sh = logging.StreamHandler(StringIO())
+        sh.setFormatter(formatter)
+        logger.addHandler(sh)
+        logger.setLevel(logging.INFO)
+        logger.info('stack', stack_info=True)
+        result = json.loads(sh.stream.getvalue())
+        self.assertEqual(result['message'], 'stack')
+        self.assertEqual(result['stack'][-1]['name'], 'test_structured_exc')
+        self.assertNotIn('line', result['stack'][-1])
+
+        # a `fmt` outputs no exception attribute keeps the traceback in `message`
+        formatter = JsonFormatter(
+            structured_exc=True,
+            level_fmts={logging.ERROR: """{"message": "message", "type": "exc_type"}"""})
+        record = logging.makeLogRecord({'msg': 'failed', 'exc_info': exc_info, 'levelno': logging.INFO})
+        self.assertTrue(json.loads(formatter.format(record))['message'].startswith(
+            'failed\nTraceback (most recent call last):\n'))
+        record = logging.makeLogRecord({'msg': 'failed', 'exc_info': exc_info, 'levelno': logging.ERROR})
+        self.assertEqual(json.loads(formatter.format(record)), {'message': 'failed', 'type': 'KeyError'})
+
+    def test_sampling_filter(self):
+        def _record(level=logging.INFO, lineno=1):
+            return logging.makeLogRecord({
+                'msg': 'sampling', 'levelno': level,
+                'levelname': logging.getLevelName(level), 'lineno': lineno,
+                'pathname': 'test.py', 'name': 'test'
+            })
+
+        sampling = SamplingFilter(
+            level_rates={'DEBUG': 0, logging.INFO: 0.5, 'WARNING': 1}, summary_interval=None)
+        self.assertFalse(sampling.filter(_record(logging.DEBUG)))
+        self.assertTrue(sampling.filter(_record(logging.ERROR)))
+        kept = sum(sampling.filter(_record()) for _ in range(2000))
+        self.assertTrue(800 < kept < 1200)
+        self.assertRaises(ValueError, SamplingFilter, level_rates={'UNKNOWN': 1})
+        self.assertRaises(ValueError, SamplingFilter, level_rates={'INFO': 2})
+
+        # token bucket of every call site
+        sampling = SamplingFilter(rate=0.001, burst=3, summary_interval=None)
+        self.assertEqual([sampling.filter(_record()) for _ in range(5)], [True] * 3 + [False] * 2)
+        self.assertTrue(sampling.filter(_record(lineno=2)))
+        # less than one record per second
+        slow = SamplingFilter(rate=0.5, summary_interval=None)
+        self.assertEqual([slow.filter(_record()) for _ in range(2)], [True, False])
+
+        # summary of the suppressed records
+        logger = logging.getLogger()
+        sh = logging.StreamHandler(StringIO())
+        sh.setFormatter(JsonFormatter(
+            """{"levelname": "levelname", "message": "message"}""", mix_extra=True))
+        sh.addFilter(sampling)
+        logger.addHandler(sh)
+        logger.setLevel(logging.INFO)
+        sampling.summary_logger = logger
+        sampling.summarize()
+        result = json.loads(sh.stream.getvalue())
+        # `LogRecord` has `taskName` attribute from python 3.12
+        result.pop('taskName', None)
+        self.assertEqual(result, {
+            "levelname": "WARNING",
+            "message": "suppressed 2 records at 1 call sites",
+            "suppressed": [{"name": "test", "pathname": "test.py", "lineno": 1, "count": 2}]
+        })
+        # nothing to summarize
+        sampling.summarize()
+        self.assertEqual(len(sh.stream.getvalue().splitlines()), 1)
+
+    def test_sampling_filter_adaptive(self):
+        sampling = SamplingFilter(target_rate=10, summary_interval=None)
+        record = logging.makeLogRecord({'msg': 'adaptive'})
+        now = sampling._window_start
+        for _ in range(1000):
+            self.assertEqual(sampling.adaptiveProbability(now), 1.0)
+        self.assertAlmostEqual(sampling.adaptiveProbability(now + 1), 0.01)
+
+        # a burst over the target rate is dropped from the next second
+        logger = logging.getLogger('test_sampling_filter_adaptive')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        # `fileConfig` disables the existing loggers
+        logger.disabled = False
+        sh = logging.StreamHandler(StringIO())
+        sh.setFormatter(JsonFormatter("""{"message": "message", "suppressed": "suppressed"}"""))
+        logger.addHandler(sh)
+        self.addCleanup(logger.removeHandler, sh)
+        sampling = SamplingFilter(target_rate=10, summary_interval=None, summary_logger=logger)
+        random.seed(1)
+        self.assertEqual(sum(sampling.filter(record) for _ in range(1000)), 1000)
+        # the first second is over
+        sampling._window_start -= 1
+        kept = sum(sampling.filter(record) for _ in range(2000))
+        self.assertTrue(0 < kept < 60, kept)
+        sampling.close()
+        result = json.loads(sh.stream.getvalue())
+        self.assertEqual(result['message'], 'suppressed %d records at 1 call sites' % (2000 - kept))
+        self.assertEqual(result['suppressed'][0]['count'], 2000 - kept)
+
+        # the summary is logged by the timer if no record comes later
+        sh.stream = StringIO()
+        sampling = SamplingFilter(rate=0.001, burst=1, summary_interval=0.05, summary_logger=logger)
+        self.assertEqual([sampling.filter(record) for _ in range(3)], [True, False, False])
+        for _ in range(100):
+            if sh.stream.getvalue():
+                break
+            time.sleep(0.01)
+        self.assertEqual(json.loads(sh.stream.getvalue())['message'], 'suppressed 2 records at 1 call sites')
+        sampling.close()
+        self.assertEqual(len(sh.stream.getvalue().splitlines()), 1)
+
+    def test_size_limits(self):
+        def _record(**kw):
+            kw.setdefault('msg', 'hello world')
+            record = logging.makeLogRecord(kw)
+            # `LogRecord` has `taskName` attribute from python 3.12, it
+            # would be mixed as extra
+            record.__dict__.pop('taskName', None)
+            return record
+
+        formatter = JsonFormatter(
+            """{"message": "message", "body": "body", "items": "items"}""",
+            max_message_length=5, max_value_length=3)
+        self.assertEqual(
+            json.loads(formatter.format(_record(msg='hi', body='abc', items=[1, 2]))),
+            {"message": "hi", "body": "abc", "items": [1, 2]})
+        self.assertEqual(
+            json.loads(formatter.format(_record(body='abcdef', items=[1, 2, {'a': 'abcd'}, 4]))),
+            {"message": "hello", "body": "abc", "items": [1, 2, {'a': 'abc'}], "truncated": True})
+
+        # the attributes of `LogRecord` and templates aren't limited
+        formatter = JsonFormatter(
+            """{"message": "message", "msg": "msg", "asctime": "asctime", "log": "%(name)s %(msg)s", "user": "user"}""",
+            record_custom_attrs={'user': lambda: 'administrator'},
+            max_message_length=20, max_value_length=5)
+        result = json.loads(formatter.format(_record(name='root')))
+        self.assertEqual(result['message'], 'hello world')
+        self.assertEqual(result['msg'], 'hello world')
+        self.assertEqual(len(result['asctime']), 23)
+        self.assertEqual(result['log'], 'root hello world')
+        self.assertEqual(result['user'], 'admin')
+        self.assertEqual(result['truncated'], True)
+
+        # `extra` is limited, even if it overwrites a `fmt` key
+        formatter = JsonFormatter(
+            """{"message": "message", "user": "levelname"}""",
+            mix_extra=True, max_value_length=5)
+        self.assertEqual(
+            json.loads(formatter.format(_record(levelname='WARNING', user='administrator', status='accepted'))),
+            {"message": "hello world", "user": "admin", "status": "accep", "truncated": True})
+        self.assertEqual(
+            json.loads(formatter.format(_record(levelname='WARNING'))),
+            {"message": "hello world", "user": "WARNING"})
+
+        # the marker replaces the value of `truncated` key in `fmt`
+        for options in ({}, {'max_line_bytes': 1000}, {'mix_extra': True}):
+            formatter = JsonFormatter(
+                """{"message": "message", "truncated": "truncated"}""",
+                max_message_length=5, **options)
+            self.assertEqual(
+                json.loads(formatter.format(_record(truncated='no')), object_pairs_hook=list),
+                [("message", "hello"), ("truncated", True)])
+            self.assertEqual(
+                json.loads(formatter.format(_record(msg='hi', truncated='no')), object_pairs_hook=list),
+                [("message", "hi"), ("truncated", "no")])
+
+        # the results of `default` are limited too
+        formatter = JsonFormatter(
+            """{"message": "message", "body": "body"}""",
+            default=lambda o: 'x' * 100, max_value_length=3)
+        self.assertEqual(
+            json.loads(formatter.format(_record(body=object()))),
+            {"message": "hello world", "body": "xxx", "truncated": True})
+        formatter.cls = json.JSONEncoder
+        formatter.indent = 2
+        self.assertEqual(
+            json.loads(formatter.format(_record(body=object()))),
+            {"message": "hello world", "body": "xxx", "truncated": True})
+
+        # the line is cut while it is encoded
+        for options in ({}, {'indent': None, 'ensure_ascii': False}, {'mix_extra': True}):
+            formatter = JsonFormatter(
+                """{"message": "message", "status": "status", "body": "body", "code": "code"}""",
+                max_line_bytes=100, **options)
+            line = formatter.format(_record(body=u'' * 1000, status=200, code=[1, 2, 3]))
+            self.assertTrue(len(line.encode('utf-8')) <= 100)
+            result = json.loads(line)
+            self.assertEqual(result['message'], 'hello world')
+            self.assertTrue(result['body'].startswith(u''))
+            self.assertEqual(result['status'], 200)
+            # even `null` is too long
+            self.assertNotIn('code', result)
+            self.assertEqual(result['truncated'], True)
+            result = json.loads(formatter.format(_record(body='short', status=200, code=None)))
+            self.assertEqual(result['body'], 'short')
+            self.assertNotIn('truncated', result)
+
+        # a huge value isn't encoded in full before it is cut
+        encoded = []
+
+        def _default(o):
+            encoded.append(o)
+            return 'object'
+
+        for options in ({}, {'mix_extra': True}):
+            formatter = JsonFormatter(
+                """{"items": "items", "message": "message"}""",
+                default=_default, max_line_bytes=100, **options)
+            line = formatter.format(_record(msg='x' * 100000, items=[object()] * 100000))
+            self.assertTrue(len(line) <= 100)
+            result = json.loads(line)
+            self.assertEqual(result['items'], None)
+            self.assertTrue(result['message'].startswith('xxx'))
+            self.assertEqual(encoded, [])
+
+        # the indented line is longer than the measured one
+        self.assertRaises(ValueError, JsonFormatter, max_line_bytes=100, indent=2)
+        self.assertRaises(ValueError, JsonFormatter, max_line_bytes=100, indent=0, mix_extra=True)
+
+    def test_collect_stats(self):
+        self.assertEqual(JsonFormatter().stats(), None)
+
+        formatter = JsonFormatter(
+            """{"asctime": "asctime", "message": "message", "user": "user"}""",
+            record_custom_attrs={'user': lambda: 'admin'}, mix_extra=True, collect_stats=True)
+        lines = [
+            formatter.format(logging.makeLogRecord({'msg': 'stats %s', 'args': (i, ), 'status': 200}))
+            for i in range(3)
+        ]
+        stats = formatter.stats()
+        self.assertEqual(stats['records'], 3)
+        self.assertEqual(stats['output_bytes'], sum(len(line) for line in lines))
+        self.assertEqual(
+            set(stats['phases']),
+            {'format', 'message', 'time', 'exception', 'extra', 'custom_attrs', 'fields', 'encode'})
+        for phase in ('format', 'message', 'time', 'extra', 'custom_attrs', 'fields', 'encode'):
+            self.assertEqual(stats['phases'][phase]['count'], 3)
+        self.assertEqual(stats['phases']['exception']['count'], 0)
+        self.assertTrue(stats['phases']['format']['ns'] >= sum(
+            v['ns'] for k, v in stats['phases'].items() if k not in ('format', 'encode')))
+
+        # counters of all the threads are summed
+        thread = threading.Thread(target=formatter.format, args=(logging.makeLogRecord({'msg': 'thread'}), ))
+        thread.start()
+        thread.join()
+        self.assertEqual(formatter.stats(reset=True)['records'], 4)
+        stats = formatter.stats()
+        self.assertEqual(stats['records'], 0)
+        self.assertEqual(stats['output_bytes'], 0)
+
+        # the counters of ended threads aren't kept one by one
+        for i in range(20):
+            thread = threading.Thread(target=formatter.format, args=(logging.makeLogRecord({'msg': 'thread'}), ))
+            thread.start()
+            thread.join()
+        self.assertTrue(len(formatter._stats._all) <= 2)
+        self.assertEqual(formatter.stats(reset=True)['records'], 20)
+        self.assertEqual(formatter.stats()['records'], 0)
+
+        # one of every 16 records is timed, scaled to all the records
+        for i in range(40):
+            formatter.format(logging.makeLogRecord({'msg': 'sampled'}))
+        stats = formatter.stats(reset=True)
+        self.assertEqual(stats['records'], 40)
+        self.assertEqual(stats['phases']['message']['count'], 40)
+        self.assertEqual(stats['phases']['exception']['count'], 0)
+
+        # non-ASCII lines are counted when they are encoded
+        formatter = JsonFormatter("""{"log": "message"}""", ensure_ascii=False, collect_stats=True)
+        formatter.format(logging.makeLogRecord({'msg': 'ascii'}))
+        self.assertEqual(formatter.stats()['output_bytes'], len('{"log": "ascii"}'))
+        formatter.format(logging.makeLogRecord({'msg': '%s', 'args': (u'\u4e2d', )}))
+        self.assertEqual(formatter.stats()['output_bytes'], len('{"log": "ascii"}'))
+        formatter.formatBytes(logging.makeLogRecord({'msg': '%s', 'args': (u'\u4e2d', )}))
+        formatter.formatMany([logging.makeLogRecord({'msg': '%s', 'args': (u'\u4e2d', )})], as_bytes=True)
+        self.assertEqual(formatter.stats()['output_bytes'], len('{"log": "ascii"}') + 2 * len(u'{"log": "\u4e2d"}'.encode('utf-8')))
+        self.assertEqual(formatter.stats()['records'], 4)
+
+        # `format` of a subclass is still called
+        class _Formatter(JsonFormatter):
+            def format(self, record):
+                return 'prefix ' + JsonFormatter.format(self, record)
+
+        formatter = _Formatter("""{"log": "message"}""", collect_stats=True)
+        self.assertEqual(
+            formatter.format(logging.makeLogRecord({'msg': 'subclass'})), 'prefix {"log": "subclass"}')
+        self.assertEqual(formatter.stats()['records'], 1)
+
+    def test_json_rotating_file_handler(self):
+        import gzip
+
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'rotating.log')
+        formatter = JsonFormatter("""{"log": "message"}""", collect_stats=True)
+        handler = JsonRotatingFileHandler(
+            filename, max_bytes=70, backup_count=2, compress=True)
+        handler.setFormatter(formatter)
+
+        def _lines(name, opener=open):
+            with opener(os.path.join(directory, name), 'rb') as f:
+                return [json.loads(line.decode('utf-8'))['log'] for line in f.read().splitlines()]
+
+        # every line is 35 bytes, a file keeps 2 lines
+        for i in range(7):
+            handler.handle(logging.makeLogRecord({'msg': 'rotating file handler %s' % i}))
+        handler.close()
+        # formatted once for every record
+        self.assertEqual(formatter.stats()['records'], 7)
+        self.assertEqual(
+            sorted(os.listdir(directory)), ['rotating.log', 'rotating.log.1.gz', 'rotating.log.2.gz'])
+        self.assertEqual(_lines('rotating.log'), ['rotating file handler 6'])
+        self.assertEqual(
+            _lines('rotating.log.1.gz', gzip.open),
+            ['rotating file handler 4', 'rotating file handler 5'])
+        self.assertEqual(
+            _lines('rotating.log.2.gz', gzip.open),
+            ['rotating file handler 2', 'rotating file handler 3'])
+
+        # the offset of an existing file is read when it is opened
+        handler = JsonRotatingFileHandler(filename, max_bytes=70, backup_count=2, delay=True)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        handler.handle(logging.makeLogRecord({'msg': 'rotating file handler 7'}))
+        self.assertEqual(handler.offset, 70)
+        handler.handle(logging.makeLogRecord({'msg': 'rotating file handler 8'}))
+        handler.close()
+        self.assertEqual(_lines('rotating.log'), ['rotating file handler 8'])
+        self.assertEqual(
+            _lines('rotating.log.1'), ['rotating file handler 6', 'rotating file handler 7'])
+
+        # roll over by time
+        filename = os.path.join(directory, 'timed.log')
+        handler = JsonRotatingFileHandler(filename, interval=60, backup_count=1)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        for i, created in enumerate((0, 30, 60, 90, 120)):
+            handler.handle(logging.makeLogRecord({'msg': 'timed %s' % i, 'created': created}))
+        handler.close()
+        self.assertEqual(_lines('timed.log'), ['timed 4'])
+        self.assertEqual(_lines('timed.log.1'), ['timed 2', 'timed 3'])
+
+        # no backup, never rolled over by size
+        filename = os.path.join(directory, 'no_backup.log')
+        handler = JsonRotatingFileHandler(filename, max_bytes=70)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        for i in range(5):
+            handler.handle(logging.makeLogRecord({'msg': 'no backup %s' % i}))
+        handler.close()
+        self.assertEqual(_lines('no_backup.log'), ['no backup %s' % i for i in range(5)])
+        self.assertEqual([name for name in os.listdir(directory) if name.startswith('no_backup')], ['no_backup.log'])
+
+        # no backup, rolled over by time and all the backups are kept
+        filename = os.path.join(directory, 'all_backups.log')
+        handler = JsonRotatingFileHandler(filename, interval=60)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        for i in range(4):
+            handler.handle(logging.makeLogRecord({'msg': 'all backups %s' % i, 'created': i * 60}))
+        handler.close()
+        self.assertEqual(_lines('all_backups.log'), ['all backups 3'])
+        for i in range(1, 4):
+            self.assertEqual(_lines('all_backups.log.%d' % i), ['all backups %d' % (3 - i)])
+
+    def test_json_batch_file_handler(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'batch.log')
+        handler = JsonBatchFileHandler(filename, batch_records=3, batch_bytes=1024, batch_ms=None)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+
+        def _lines():
+            with open(filename, 'rb') as f:
+                return [json.loads(line.decode('utf-8'))['log'] for line in f.read().splitlines()]
+
+        for i in range(2):
+            handler.handle(logging.makeLogRecord({'msg': 'batch %s' % i}))
+        self.assertEqual(_lines(), [])
+        handler.handle(logging.makeLogRecord({'msg': 'batch 2'}))
+        self.assertEqual(_lines(), ['batch 0', 'batch 1', 'batch 2'])
+        self.assertEqual(handler.writes, 1)
+
+        # `ERROR` and above are written at once
+        handler.handle(logging.makeLogRecord({'msg': 'batch 3'}))
+        handler.handle(logging.makeLogRecord({'msg': 'batch 4', 'levelno': logging.ERROR}))
+        self.assertEqual(len(_lines()), 5)
+        self.assertEqual(handler.writes, 2)
+
+        # by bytes
+        handler.handle(logging.makeLogRecord({'msg': 'x' * 1024}))
+        self.assertEqual(len(_lines()), 6)
+
+        handler.handle(logging.makeLogRecord({'msg': 'batch 6'}))
+        handler.close()
+        self.assertEqual(_lines()[-1], 'batch 6')
+        self.assertEqual(handler.writes, 4)
+
+        # by time, even though no more record is handled
+        handler = JsonBatchFileHandler(filename, batch_ms=20)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        handler.handle(logging.makeLogRecord({'msg': 'batch 7'}))
+        for _ in range(100):
+            if _lines()[-1] == 'batch 7':
+                break
+            time.sleep(0.01)
+        self.assertEqual(_lines()[-1], 'batch 7')
+        handler.close()
+
+    def _startServer(self, server_class, request_handler):
+        server = server_class(('127.0.0.1', 0), request_handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, args=(0.05, ))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_json_logstash_handler_tcp(self):
+        received = []
+        connections = []
+
+        class TCPHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                connections.append(self.client_address)
+                for line in self.rfile:
+                    received.append(json.loads(line.decode('utf-8')))
+
+        server = self._startServer(socketserver.ThreadingTCPServer, TCPHandler)
+        handler = JsonLogstashHandler(
+            'tcp://127.0.0.1:%d' % server.server_address[1], batch_records=4)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        for i in range(10):
+            handler.handle(logging.makeLogRecord({'msg': 'tcp %s' % i}))
+        handler.close()
+        self.assertEqual(handler.sent, 10)
+        for _ in range(100):
+            if len(received) == 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(received, [{"log": "tcp %s" % i} for i in range(10)])
+        # one persistent connection
+        self.assertEqual(len(connections), 1)
+
+    def test_json_logstash_handler_http(self):
+        import gzip
+
+        received = []
+        connections = set()
+        statuses = [503, 200, 200, 200, 400]
+
+        class HTTPHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                connections.add(self.client_address)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+                status = statuses.pop(0)
+                if status == 200:
+                    received.extend(json.loads(line.decode('utf-8')) for line in body.splitlines())
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = self._startServer(ThreadingHTTPServer, HTTPHandler)
+        handler = JsonLogstashHandler(
+            'http://127.0.0.1:%d/logs' % server.server_address[1],
+            batch_records=2, compress=True, retry_backoff=0.01)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        for i in range(6):
+            handler.handle(logging.makeLogRecord({'msg': 'http %s' % i}))
+        handler.flush()
+        # the first batch is sent again after `503`
+        self.assertEqual(received, [{"log": "http %s" % i} for i in range(6)])
+        self.assertEqual(handler.sent, 6)
+        # `400` isn't retried
+        handler.handle(logging.makeLogRecord({'msg': 'http rejected'}))
+        handler.close()
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(statuses, [])
+        # the connection is kept alive, except the retried one
+        self.assertTrue(len(connections) <= 2)
+
+    def test_json_logstash_handler_spill(self):
+        # nothing listens on the port
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.assertRaises(ValueError, JsonLogstashHandler, 'udp://127.0.0.1:%d' % port)
+        self.assertRaises(ValueError, JsonLogstashHandler, 'tcp://127.0.0.1')
+        self.assertRaises(ValueError, JsonLogstashHandler, 'http:///logs')
+        self.assertRaises(
+            ValueError, JsonLogstashHandler, 'tcp://127.0.0.1:%d' % port, spill_policy='unknown')
+
+        for policy in ('drop_newest', 'drop_oldest'):
+            handler = JsonLogstashHandler(
+                'tcp://127.0.0.1:%d' % port, max_buffer_bytes=100, batch_ms=10000,
+                spill_policy=policy, max_retries=0, flush_timeout=1)
+            handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+            # every record is 20 bytes with `\n`
+            for i in range(10):
+                handler.handle(logging.makeLogRecord({'msg': 'spill %s' % i}))
+            handler.close()
+            self.assertEqual(handler.sent, 0)
+            self.assertEqual(handler.dropped, 10)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'module `__getattr__` is added in python3.7')
+    def test_lazy_handlers(self):
+        import subprocess
+
+        import jsonformatter
+
+        code = (
+            "import sys, jsonformatter\n"
+            "assert not {'asyncio', 'gzip', 'socket', 'http.client'}.intersection(sys.modules)\n"
+            "from jsonformatter import JsonAsyncHandler, JsonLogstashHandler\n"
+            "assert jsonformatter.handlers.JsonLogstashHandler is JsonLogstashHandler\n"
+            "assert jsonformatter.aio.JsonAsyncHandler is JsonAsyncHandler\n"
+        )
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(jsonformatter.__file__)))
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        self.assertRaises(AttributeError, getattr, jsonformatter, 'JsonNoHandler')
+
+    @unittest.skipIf(sys.version_info < (3, 5), "`JsonAsyncHandler` needs python3.5")
+    def test_json_async_handler(self):
+        import asyncio
+
+        from jsonformatter import JsonAsyncHandler
+
+        filename = os.path.join(tempfile.mkdtemp(), 'async.log')
+
+        def _lines():
+            with open(filename, 'rb') as f:
+                return [json.loads(line.decode('utf-8'))['log'] for line in f.read().splitlines()]
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertRaises(ValueError, JsonAsyncHandler)
+        handler = JsonAsyncHandler(filename, loop=loop, max_buffer_bytes=1024)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+
+        def _log(prefix, number):
+            for i in range(number):
+                handler.handle(logging.makeLogRecord({'msg': '%s %s' % (prefix, i)}))
+
+        # nothing is written in the loop until it yields
+        loop.call_soon(_log, 'loop', 3)
+        loop.call_soon(lambda: self.assertEqual(handler._buffer_bytes, 3 * len(b'{"log": "loop 0"}\n')))
+        loop.run_until_complete(handler.drain())
+        self.assertEqual(_lines(), ['loop 0', 'loop 1', 'loop 2'])
+
+        # from other threads
+        loop.run_until_complete(loop.run_in_executor(None, _log, 'thread', 2))
+        loop.run_until_complete(handler.drain())
+        self.assertEqual(_lines()[3:], ['thread 0', 'thread 1'])
+
+        # the loop is never blocked, records over the buffer are dropped
+        loop.call_soon(_log, 'x' * 100, 20)
+        loop.run_until_complete(handler.drain())
+        self.assertEqual(len(_lines()), 5 + 20 - handler.dropped)
+        self.assertTrue(handler.dropped > 0)
+
+        # written at once when the loop isn't running
+        _log('stopped', 1)
+        self.assertEqual(_lines()[-1], 'stopped 0')
+        # from a thread without event loop
+        thread = threading.Thread(target=_log, args=('no loop', 1))
+        thread.start()
+        thread.join()
+        self.assertEqual(_lines()[-1], 'no loop 0')
+        loop.run_until_complete(handler.aclose())
+
+        # `close` in the running loop writes the buffer
+        filename = os.path.join(os.path.dirname(filename), 'close.log')
+        handler = JsonAsyncHandler(filename, loop=loop)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        loop.call_soon(_log, 'close', 3)
+        loop.call_soon(handler.close)
+        loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(_lines(), ['close 0', 'close 1', 'close 2'])
+
+        # `close` in other thread waits the loop to write the buffer
+        filename = os.path.join(os.path.dirname(filename), 'close_thread.log')
+        handler = JsonAsyncHandler(filename, loop=loop)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            loop.call_soon_threadsafe(_log, 'close thread', 3)
+            handler.close()
+            self.assertEqual(_lines(), ['close thread 0', 'close thread 1', 'close thread 2'])
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+        # to `asyncio.StreamWriter`
+        rsock, wsock = socket.socketpair()
+        self.addCleanup(rsock.close)
+        _, writer = loop.run_until_complete(asyncio.open_connection(sock=wsock))
+        handler = JsonAsyncHandler(writer=writer, loop=loop)
+        handler.setFormatter(JsonFormatter("""{"log": "message"}"""))
+        loop.call_soon(_log, 'stream', 2)
+        loop.run_until_complete(handler.drain())
+        loop.run_until_complete(handler.aclose())
+        data = b''
+        while True:
+            chunk = rsock.recv(1024)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(data, b'{"log": "stream 0"}\n{"log": "stream 1"}\n')
+
     def tearDown(self):
         root = logging.getLogger()
         # remove handlers